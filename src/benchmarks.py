@@ -0,0 +1,256 @@
+# benchmarks.py
+"""Benchmark suite for the haiku checker, the data pipeline and generation.
+
+Three layers, each reported as throughput (higher is better):
+- unit: _count_syllables (cold: lexicon reloaded from disk and empty word
+  caches; warm: everything cached), check_syllables and check_haiku over every
+  haiku in the raw data/train/*.jsonl files
+- pipeline: merge_all_haikus and change_format on a copy of data/, plus
+  data_pipeline.run_pipeline on synthetic scale-ups of the raw corpus
+  (the real files tiled to --scale haikus, e.g. 100000 or 1000000)
+- generation: tokens/sec and samples/sec of generate_batch decoding with the
+  tiny random GPT-2 from generation.make_tiny_model, so it runs offline on CPU
+
+Every benchmark keeps the best of --repeats runs. Results are written as JSON to
+results/benchmarks/<timestamp>.json, together with the environment, and are
+compared to a stored baseline (results/benchmarks/baseline.json by default):
+anything more than --tolerance slower than its baseline counts as a regression
+and makes the script exit with status 1. Run from root:
+    python src/benchmarks.py --quick
+    python src/benchmarks.py --save-baseline
+    python src/benchmarks.py --only pipeline --scale 100000 1000000
+"""
+
+
+import os, sys, json, time, shutil, platform, tempfile, argparse, contextlib, subprocess
+from haiku_check_helpers import _count_syllables, check_syllables, check_haiku
+from syllable_lexicon import clear_caches, get_table
+from merge_data import raw_train_files
+
+
+BENCHMARK_DIR = 'results/benchmarks/'
+BASELINE_PATH = BENCHMARK_DIR + 'baseline.json'
+LAYERS = ['unit', 'pipeline', 'generation']
+
+
+def _best_time(fn, repeats):
+    """Best wall-clock time over repeats calls of fn."""
+    best = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def _result(name, items, seconds, unit, **extra):
+    return {"name": name, "unit": unit, "items": items, "seconds": seconds,
+            "throughput": items / seconds if seconds > 0 else float("inf"), **extra}
+
+
+def _raw_records(filenames):
+    records = []
+    for filename in filenames:
+        with open(filename, 'r', encoding='utf-8') as f:
+            records += [json.loads(line) for line in f if line.strip()]
+    return records
+
+
+@contextlib.contextmanager
+def _data_copy():
+    """Runs the body from a temporary directory holding a copy of data/, so the
+    scripts that write relative to root (merge_all_haikus, ...) leave the repo alone."""
+    root = os.getcwd()
+    get_table() # load the lexicon from the real cache/ before leaving root
+    with tempfile.TemporaryDirectory() as tmp:
+        shutil.copytree(os.path.join(root, 'data'), os.path.join(tmp, 'data'))
+        os.chdir(tmp)
+        try:
+            yield tmp
+        finally:
+            os.chdir(root)
+
+
+# --- unit ---
+def bench_unit(repeats=3):
+    records = _raw_records(raw_train_files())
+    haikus = [r['haiku'] for r in records]
+    words = [w for h in haikus for w in h.split()]
+    results = []
+
+    def count_cold():
+        clear_caches() # the first lookup reloads cache/syllable_lexicon.bin
+        for w in words:
+            _count_syllables(w)
+    results.append(_result("unit/count_syllables_cold", len(words), _best_time(count_cold, repeats), "words/s"))
+
+    def count_warm():
+        for w in words:
+            _count_syllables(w)
+    count_warm()
+    results.append(_result("unit/count_syllables_warm", len(words), _best_time(count_warm, repeats), "words/s"))
+
+    def syllables():
+        for h in haikus:
+            check_syllables(h, givelinetruth=True)
+    results.append(_result("unit/check_syllables", len(haikus), _best_time(syllables, repeats), "haikus/s"))
+
+    def haiku_checks():
+        for r in records:
+            check_haiku(r['keyword'], r['haiku'])
+    results.append(_result("unit/check_haiku", len(records), _best_time(haiku_checks, repeats), "haikus/s"))
+    return results
+
+
+# --- pipeline ---
+def _tile_corpus(records, n, filename):
+    """Writes n raw haiku records to filename by repeating the corpus in order, so
+    generation batches (runs of prompt_num) keep their real sizes."""
+    with open(filename, 'w', encoding='utf-8') as f:
+        for i in range(n):
+            f.write(json.dumps(records[i % len(records)]) + "\n")
+
+
+def bench_pipeline(repeats=3, scales=(100000,)):
+    from merge_data import merge_all_haikus
+    from format_data import change_format
+    from data_pipeline import run_pipeline
+
+    results = []
+    with _data_copy(), open(os.devnull, 'w') as devnull:
+        records = _raw_records(raw_train_files())
+        eval_records = _raw_records(['data/eval/cosmology.jsonl'])
+
+        def merge():
+            with contextlib.redirect_stdout(devnull):
+                merge_all_haikus()
+        results.append(_result("pipeline/merge_all_haikus", len(records) + len(eval_records),
+                               _best_time(merge, repeats), "haikus/s"))
+
+        num_merged = len(_raw_records(['data/train/merged.jsonl']))
+        def format_train():
+            with contextlib.redirect_stdout(devnull):
+                change_format("data/train/merged.jsonl", "data/train/train_data.jsonl")
+        results.append(_result("pipeline/change_format", num_merged, _best_time(format_train, repeats), "haikus/s"))
+
+        for n in scales:
+            _tile_corpus(records, n, 'synthetic.jsonl')
+            def pipeline():
+                run_pipeline(['synthetic.jsonl'], 'synthetic_merged.jsonl',
+                             {'keyword_numbered': 'synthetic_data.jsonl'}, deduplicate=False)
+            # one run at scale is long enough to time reliably
+            results.append(_result(f"pipeline/run_pipeline_{n}", n, _best_time(pipeline, 1), "haikus/s"))
+    return results
+
+
+# --- generation ---
+def bench_generation(repeats=3, batch_sizes=(1, 8), max_new_tokens=32):
+    from generation import make_tiny_model, load_model_and_tokenizer, generate_batch
+    from eval_scoring import make_zero_shot_prompt
+    from test_data_keywords import particle_physics_keywords
+
+    model, tok = load_model_and_tokenizer(make_tiny_model())
+    results = []
+    for batch_size in batch_sizes:
+        prompts = [make_zero_shot_prompt(kw) for kw in particle_physics_keywords[:batch_size]]
+        prompts += [prompts[-1]] * (batch_size - len(prompts))
+        stats = {}
+
+        def generate():
+            stats.clear()
+            # stop_at_end=False: an untrained model rarely finishes, and fixed lengths keep runs comparable
+            generate_batch(model, tok, prompts, list(range(batch_size)), max_new_tokens=max_new_tokens,
+                           stop_at_end=False, stats=stats)
+        generate() # warm-up
+        seconds = _best_time(generate, repeats)
+        tokens = stats['generated_tokens']
+        results.append(_result(f"generation/tokens_batch{batch_size}", tokens, seconds, "tokens/s"))
+        results.append(_result(f"generation/samples_batch{batch_size}", batch_size, seconds, "samples/s"))
+    return results
+
+
+# --- reporting ---
+def environment():
+    import numpy
+    env = {"python": platform.python_version(), "platform": platform.platform(),
+           "processor": platform.processor(), "cpu_count": os.cpu_count(), "numpy": numpy.__version__}
+    try:
+        import torch, transformers
+        env.update(torch=torch.__version__, transformers=transformers.__version__, torch_threads=torch.get_num_threads())
+    except ImportError:
+        pass
+    try:
+        env["git_commit"] = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True,
+                                           text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        pass
+    return env
+
+
+def compare(results, baseline, tolerance=0.2):
+    """Adds each result's ratio to its baseline throughput (>1 is faster) and whether
+    it regressed by more than tolerance. Returns the names of regressed benchmarks."""
+    base = {r["name"]: r for r in baseline.get("results", [])}
+    regressions = []
+    for r in results:
+        if r["name"] not in base:
+            continue
+        r["baseline_throughput"] = base[r["name"]]["throughput"]
+        r["ratio"] = r["throughput"] / r["baseline_throughput"]
+        r["regressed"] = r["ratio"] < 1 - tolerance
+        if r["regressed"]:
+            regressions.append(r["name"])
+    return regressions
+
+
+def run_benchmarks(layers=LAYERS, repeats=3, scales=(100000,)):
+    results = []
+    if 'unit' in layers:
+        results += bench_unit(repeats)
+    if 'pipeline' in layers:
+        results += bench_pipeline(repeats, scales)
+    if 'generation' in layers:
+        results += bench_generation(repeats)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the haiku checker, data pipeline and generation.")
+    parser.add_argument("--only", nargs="+", choices=LAYERS, default=LAYERS)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--scale", nargs="+", type=int, default=[100000],
+                        help="synthetic corpus sizes for run_pipeline (default: 100000)")
+    parser.add_argument("--quick", action="store_true", help="1 repeat and a 10000-haiku scale-up")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed slowdown vs. baseline (default: 0.2)")
+    parser.add_argument("--save-baseline", action="store_true", help="also save these results as the baseline")
+    parser.add_argument("--out", default=None, help="output JSON (default: results/benchmarks/<timestamp>.json)")
+    args = parser.parse_args()
+    if args.quick:
+        args.repeats, args.scale = 1, [10000]
+
+    results = run_benchmarks(args.only, args.repeats, args.scale)
+    regressions = []
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+
+    report = {"created": time.strftime("%Y-%m-%d %H:%M:%S"), "environment": environment(),
+              "repeats": args.repeats, "results": results}
+    out = args.out or BENCHMARK_DIR + time.strftime("%Y%m%d-%H%M%S") + ".json"
+    os.makedirs(os.path.dirname(out) or '.', exist_ok=True)
+    with open(out, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=1)
+    if args.save_baseline:
+        shutil.copyfile(out, args.baseline)
+
+    for r in results:
+        line = f"{r['name']:<36} {r['throughput']:>14,.1f} {r['unit']:<10} ({r['items']} in {r['seconds']:.3f}s)"
+        if "ratio" in r:
+            line += f"  x{r['ratio']:.2f} vs baseline" + ("  REGRESSION" if r["regressed"] else "")
+        print(line)
+    print(f"\nSaved {out}" + (f" and {args.baseline}" if args.save_baseline else ""))
+    if regressions:
+        print(f"{len(regressions)} regression(s) beyond {args.tolerance:.0%}: {', '.join(regressions)}")
+        sys.exit(1)
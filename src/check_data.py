@@ -4,34 +4,28 @@ The checks on each haiku are:
 1) it has 3 lines, 
 2) the physics keyword appears verbatim (case-insensitive) once,
 3) it obeys the 5-7-5 syllable count.
+Run from root; pass --workers N to check files (or chunks of large files) in
+N parallel processes. The printed output is the same for any N.
 """
 
 
-import json
-from haiku_check_helpers import check_haiku
+import argparse
+from parallel_check import check_jsonl_files
 
 
-def _check_haikus_in_jsonl(filename, verbose=False):
-    """Checks all haikus in a given JSONL file.
-    Prints summary of how many haikus passed/failed and details of failures.
+def _summarize_checked_jsonl(filename, results, verbose=False):
+    """Summarizes the check results for all haikus in a given JSONL file.
+    Prints summary of how many haikus passed/failed if verbose.
     Returns (True, total_haikus, None) if all haikus pass. If any haiku fails, 
     returns (False, failed_haikus, failed_details).
     """
-    total_haikus = 0
+    total_haikus = len(results)
     failed_haikus = 0
     failed_details = []
-
-    with open(filename, 'r') as f:
-        for line in f:
-            total_haikus += 1
-            data = json.loads(line)
-            keyword = data['keyword']
-            haiku = data['haiku']
-
-            passed, error_message = check_haiku(keyword, haiku)
-            if not passed:
-                failed_haikus += 1
-                failed_details.append((total_haikus, f"Haiku #{total_haikus} failed: "+error_message))
+    for haiku_num, result in enumerate(results, start=1):
+        if not result.passed:
+            failed_haikus += 1
+            failed_details.append((haiku_num, f"Haiku #{haiku_num} failed: "+result.error_message))
 
     if verbose:
         print(f"--- Haiku Check Summary for {filename} ---")
@@ -44,23 +38,37 @@ def _check_haikus_in_jsonl(filename, verbose=False):
         return True, total_haikus, None
 
 
-def check_all_haikus(verbose=False):
+def _check_haikus_in_jsonl(filename, verbose=False):
+    """Checks all haikus in a given JSONL file.
+    Prints summary of how many haikus passed/failed and details of failures.
+    Returns (True, total_haikus, None) if all haikus pass. If any haiku fails, 
+    returns (False, failed_haikus, failed_details).
+    """
+    [(_, _, results)] = check_jsonl_files([filename])
+    return _summarize_checked_jsonl(filename, results, verbose)
+
+
+def check_all_haikus(verbose=False, workers=1):
     """Checks all haikus in all JSONL files in data/train/
     (assumes it's called from root). Checks all haikus in
     data/eval/cosmology.jsonl. Prints summary of results.
+    All files are checked up front, in parallel if workers > 1.
     """
+    from train_data_keywords import train_families
+
+    train_files = ['data/train/' + f"{fam}.jsonl" for fam in train_families]
+    eval_file = 'data/eval/cosmology.jsonl'
+    checked = check_jsonl_files(train_files + [eval_file], workers=workers)
+    results_by_file = {filename: results for filename, _, results in checked}
+
     print("=== Starting training data checks ===")
     
     all_haiku_fails = []
     num_haiku_fails = 0
-    
-    from train_data_keywords import train_families
 
-    for fam in train_families:
-        dirname = 'data/train/'
-        filename = dirname + f"{fam}.jsonl"
+    for filename in train_files:
         print(f"\n--- Checking haikus in {filename} ---")
-        all_passed, failed_haikus, failed_details = _check_haikus_in_jsonl(filename, verbose)
+        all_passed, failed_haikus, failed_details = _summarize_checked_jsonl(filename, results_by_file[filename], verbose)
         if not all_passed:
             all_haiku_fails.append((filename, failed_details))
             num_haiku_fails += failed_haikus   
@@ -69,9 +77,9 @@ def check_all_haikus(verbose=False):
     print("=== Starting evaluation data checks ===")
 
     num_haiku_fails = 0 # re-zero to now count evaluation haiku fails
-    filename = 'data/eval/cosmology.jsonl'
+    filename = eval_file
     print(f"\n--- Checking haikus in {filename} ---")
-    all_passed, failed_haikus, failed_details = _check_haikus_in_jsonl(filename, verbose)
+    all_passed, failed_haikus, failed_details = _summarize_checked_jsonl(filename, results_by_file[filename], verbose)
     if not all_passed:
         all_haiku_fails.append((filename, failed_details))
         num_haiku_fails += failed_haikus  
@@ -86,4 +94,8 @@ def check_all_haikus(verbose=False):
 
 
 if __name__ == "__main__":
-    check_all_haikus(verbose = False)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Check all raw training/evaluation haikus.")
+    parser.add_argument("--workers", type=int, default=1, help="number of worker processes (default: 1)")
+    parser.add_argument("--verbose", action="store_true", help="print per-file summaries and every failure")
+    args = parser.parse_args()
+    check_all_haikus(verbose=args.verbose, workers=args.workers)
@@ -0,0 +1,160 @@
+# data_pipeline.py
+"""Streaming validate -> merge -> format pipeline for the training and evaluation data.
+
+Replaces running merge_data.py and then format_data.py with a single pass over
+the raw haikus: records are read, screened for repetitive generation batches,
+checked (in chunks with check_many), optionally deduped, and written to merged.jsonl and to one formatted file per requested
+format template, all as they stream through. Memory stays constant apart from the
+dedupe set of 16-byte digests, so a format sweep costs one scan of the raw data
+instead of one rebuild per variant.
+
+build_all applies the same policy as merge_data.py (no dedupe), so data/*/merged.jsonl
+is byte-for-byte the same whichever of the two wrote it. Dedupe is opt-in via
+run_pipeline(deduplicate=True), e.g. for experiments.py's own merged files.
+
+Outputs (run from root):
+- data/*/merged.jsonl with the good raw haikus (same as merge_data.py)
+- data/train/train_data.jsonl and data/eval/eval_data.jsonl in DEFAULT_TEMPLATE format
+- data/*/formats/<train|eval>_data_<template>.jsonl for every other requested template
+
+    python src/data_pipeline.py --templates haiku_plain haiku_line_tags
+"""
+
+
+import os, re, json, hashlib, argparse, itertools
+from haiku_check_helpers import check_many
+from line_index import repetitive_batch
+from format_data import FORMAT_TEMPLATES, DEFAULT_TEMPLATE, format_record
+from merge_data import raw_train_files
+
+
+CHUNK_SIZE = 500 # records checked per check_many call
+
+
+def read_raw(filenames, stats):
+    """Yields every raw haiku record in filenames, in order."""
+    for filename in filenames:
+        with open(filename, 'r', encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    stats['read'] += 1
+                    yield json.loads(line)
+
+
+def reject_repetitive(records, stats):
+    """Yields the records of one raw file, dropping whole generation batches (runs
+    with the same prompt_num) that repeat lines across their haikus."""
+    for _, batch in itertools.groupby(records, key=lambda data: data['prompt_num']):
+        batch = list(batch)
+        if repetitive_batch([data['haiku'] for data in batch]):
+            stats['repetitive'] += len(batch)
+        else:
+            yield from batch
+
+
+def check_records(records, stats, chunk_size=CHUNK_SIZE):
+    """Yields the records whose haikus pass all checks, checking chunk_size at a time."""
+    chunk = []
+    for data in records:
+        chunk.append(data)
+        if len(chunk) == chunk_size:
+            yield from _passing(chunk, stats)
+            chunk = []
+    if chunk:
+        yield from _passing(chunk, stats)
+
+
+def _passing(chunk, stats):
+    results = check_many([r['keyword'] for r in chunk], [r['haiku'] for r in chunk])
+    for data, result in zip(chunk, results):
+        if result.passed:
+            yield data
+        else:
+            stats['failed'] += 1
+
+
+def _dedupe_key(data):
+    # same keyword and same haiku up to case and whitespace counts as a duplicate
+    haiku = re.sub(r"\s+", " ", data['haiku']).strip().lower()
+    text = data['keyword'].lower() + "\x00" + haiku
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=16).digest()
+
+
+def dedupe(records, stats):
+    """Yields records, dropping any repeat of an earlier (keyword, haiku) pair."""
+    seen = set()
+    for data in records:
+        key = _dedupe_key(data)
+        if key in seen:
+            stats['duplicates'] += 1
+            continue
+        seen.add(key)
+        yield data
+
+
+def write_outputs(records, merged_path, template_paths, stats):
+    """Writes each record to merged_path as-is and to template_paths[name]
+    formatted with that template, keeping every output file open for one pass."""
+    files = {}
+    try:
+        for path in [merged_path] + list(template_paths.values()):
+            dirname = os.path.dirname(path)
+            if dirname:
+                os.makedirs(dirname, exist_ok=True)
+            files[path] = open(path, 'w', encoding='utf-8')
+        merged_f = files[merged_path]
+        for data in records:
+            merged_f.write(json.dumps(data) + "\n")
+            for name, path in template_paths.items():
+                files[path].write(json.dumps(format_record(data, name)) + "\n")
+            stats['written'] += 1
+    finally:
+        for f in files.values():
+            f.close()
+
+
+def run_pipeline(filenames, merged_path, template_paths, deduplicate=False):
+    """Streams the raw haiku files through batch screening -> check -> dedupe -> format -> write.
+    template_paths maps format template name -> output path.
+    Returns a dict of counts (read, repetitive, failed, duplicates, written)."""
+    stats = {'read': 0, 'repetitive': 0, 'failed': 0, 'duplicates': 0, 'written': 0}
+    records = itertools.chain.from_iterable(
+        reject_repetitive(read_raw([filename], stats), stats) for filename in filenames)
+    records = check_records(records, stats)
+    if deduplicate:
+        records = dedupe(records, stats)
+    write_outputs(records, merged_path, template_paths, stats)
+    return stats
+
+
+def _template_paths(dirname, split, templates):
+    """Output path for each template: the default goes to <split>_data.jsonl,
+    others to formats/<split>_data_<template>.jsonl."""
+    paths = {DEFAULT_TEMPLATE: f"{dirname}{split}_data.jsonl"}
+    for name in templates:
+        if name != DEFAULT_TEMPLATE:
+            paths[name] = f"{dirname}formats/{split}_data_{name}.jsonl"
+    return paths
+
+
+def build_all(templates=()):
+    """Runs the pipeline for the training data (data/train/) and the evaluation
+    data (data/eval/cosmology.jsonl), without dedupe like merge_data.py.
+    Assumes it's called from root."""
+    for split, dirname, filenames in [
+        ('train', 'data/train/', raw_train_files()),
+        ('eval', 'data/eval/', ['data/eval/cosmology.jsonl']),
+    ]:
+        template_paths = _template_paths(dirname, split, templates)
+        print(f"=== Building {split} data: {', '.join(template_paths)} ===")
+        stats = run_pipeline(filenames, dirname + 'merged.jsonl', template_paths)
+        print(f"{stats['read']} haikus read, {stats['repetitive']} in repetitive batches omitted, "
+              f"{stats['failed']} bad haikus omitted, {stats['written']} saved.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check, merge and format all haiku data in one pass.")
+    parser.add_argument("--templates", nargs="*", default=[], choices=sorted(FORMAT_TEMPLATES),
+                        help=f"extra format templates to write alongside {DEFAULT_TEMPLATE}")
+    args = parser.parse_args()
+    build_all(args.templates)
@@ -0,0 +1,224 @@
+# eval_scoring.py
+"""Prompt formats and haiku checks used to score model completions on the
+test keywords (see notebooks/test_models.ipynb).
+
+The consistency checks are the same ones used to curate the training dataset,
+run through haiku_check_helpers.check_many so each completion is tokenized
+only once. Some additional pre-processing must take place to handle generated
+haikus with explicit line numbers or <END> lines, and few-shot completions
+that copy an example haiku line verbatim don't get credit for that line.
+"""
+
+
+import re
+from haiku_check_helpers import check_many
+
+
+END_TOKEN = "<END>"
+
+
+def make_zero_shot_prompt(keyword):
+    return f"Write 3 lines about Keyword: {keyword}\n1)\n2)\n3)"
+
+def make_few_shot_prompt(keyword):
+    return f"""Write a haiku about physics
+
+    Example 1
+    Write 3 lines about Keyword: force\n1)\n2)\n3)
+    1) Force and mass balanced
+    2) By an acceleration
+    3) Newton demands it
+    <END>
+
+    Example 2
+    Write 3 lines about Keyword: energy\n1)\n2)\n3)
+    1) Conservation sets
+    2) Before and after the same
+    3) Energy preserved
+    <END>
+
+    Example 3
+    Write 3 lines about Keyword: symmetry\n1)\n2)\n3)
+    1) Symmetry profound
+    2) Conserved currents do abound
+    3) Noether lead us now
+    <END>
+
+    Write 3 lines about Keyword: {keyword}\n1)\n2)\n3)
+    """
+
+
+def _strip_line_number_prefix(s):
+    # "1) ", "2. ", ... or the <LINE1> tags of the haiku_line_tags format
+    return re.sub(r"^\s*(?:\d+\s*[\)\.\:\-]|<LINE\d+>)\s*", "", s).strip()
+
+# The few-shot base model frequently copies example haiku lines verbatim; we need to
+# make sure any verbatim copies of example haiku lines don't artificially inflate
+# the corresponding pass rates
+def _normalize_line_for_copy_check(s):
+    # remove "1) " prefixes etc, lowercase, collapse whitespace, strip punctuation at ends
+    s = _strip_line_number_prefix(s)
+    s = s.strip().lower()
+    s = re.sub(r"\s+", " ", s)
+    s = re.sub(r"[^\w\s']+", "", s)  # drop punctuation (keeps apostrophes)
+    return s.strip()
+
+def _fewshot_example_lines_set():
+    """
+    Build the set of normalized example haiku lines from make_few_shot_prompt.
+    We intentionally ignore the final "real" keyword prompt by only extracting lines
+    from the Example 1/2/3 blocks.
+    """
+    p = make_few_shot_prompt("DUMMY_KEYWORD_DO_NOT_MATCH")
+    lines = []
+
+    # Grab each "Example N ... <END>" block, then extract its 1)/2)/3) lines
+    example_blocks = re.findall(r"Example\s+\d+.*?<END>", p, flags=re.DOTALL)
+    for blk in example_blocks:
+        # capture the three haiku lines that start with 1) / 2) / 3)
+        for m in re.findall(r"^\s*\d+\)\s*(.+)$", blk, flags=re.MULTILINE):
+            lines.append(m)
+
+    out = set()
+    for x in lines:
+        norm = _normalize_line_for_copy_check(x)
+        if norm: # we don't want to accidentally include an empty line in our matching set!
+            out.add(norm)
+    return out
+
+FEWSHOT_EXAMPLE_LINES = _fewshot_example_lines_set() # the example-haiku-lines set for weeding out cheating
+
+
+def _extract_haiku_lines_from_response(response):
+    """Extract up to 3 haiku lines from a model completion.
+
+    Handles:
+      - SFT format ending with <END>
+      - base-model "prompt echo" (e.g., if it repeats the instruction / '1)' placeholders)
+    """
+
+    lines = []
+    for raw in response.splitlines():
+        s = raw.strip()
+        if not s:
+            continue
+
+        # Skip common prompt-echo lines.
+        if re.match(r"^Write\s+3\s+lines\s+about\s+Keyword\s*:", s, flags=re.IGNORECASE):
+            continue
+
+        su = s.upper()
+        if su == END_TOKEN:
+            break
+
+        if END_TOKEN in su:
+            before = raw.split(END_TOKEN, 1)[0].strip()
+            content = _strip_line_number_prefix(before)
+            if content:
+                lines.append(content)
+            break
+
+        content = _strip_line_number_prefix(s)
+        if not content:
+            # e.g. bare "1)" / "2)" / "3)" placeholders
+            continue
+        lines.append(content)
+
+    return lines
+
+def _get_keyword(prompt):
+    # Search for the keyword phrasing
+    matches = re.findall(r"Write 3 lines about Keyword:\s*(.+?)\s*(?:\n|$)", prompt, re.IGNORECASE)
+    if not matches:
+        raise ValueError(f"Could not extract keyword from prompt: {prompt!r}")
+    # for the few-shot prompt, it's important to take the LAST match which corresponds to the real
+    # keyword prompt and not one of the examples
+    return matches[-1].strip().strip("\"'")
+
+
+def _result_dict(keyword, lines, check):
+    """Turns a HaikuCheck for the extracted lines into the scoring dict,
+    invalidating any syllable-passing line copied from the few-shot examples."""
+    line_ok = (check.line_truth + [False, False, False])[:3] # if < 3 lines, pad per-line syllable check to 3
+
+    # To prevent few-shot model cheating, make sure any passed-syllables lines didn't copy an example haiku line
+    copied_line_flags = [False, False, False]
+    for i in range(min(3, len(lines))):
+        if line_ok[i]:
+            norm = _normalize_line_for_copy_check(lines[i])
+            if norm in FEWSHOT_EXAMPLE_LINES:
+                copied_line_flags[i] = True
+                line_ok[i] = False  # fail that line
+
+    # recompute syllables_ok after copy-based invalidation
+    syllables_ok = all(line_ok[:3])
+
+    return {
+        "lines_ok": bool(check.lines_ok),
+        "keyword_ok": bool(check.keyword_ok),
+        "syllables_ok": bool(syllables_ok),
+        "syllables_l1_ok": bool(line_ok[0]),
+        "syllables_l2_ok": bool(line_ok[1]),
+        "syllables_l3_ok": bool(line_ok[2]),
+        "haiku_ok": bool(check.lines_ok and check.keyword_ok and syllables_ok),
+        "keyword": keyword,
+        "keyword_count": int(check.keyword_count),
+        "syllable_counts": check.syllable_counts,
+        "lines": lines,
+        "copied_l1": bool(copied_line_flags[0]),
+        "copied_l2": bool(copied_line_flags[1]),
+        "copied_l3": bool(copied_line_flags[2]),
+    }
+
+
+def score_completions(prompts, completions, keywords=None):
+    """Scores a batch of model completions, where completions[i] answers prompts[i].
+    keywords[i] is prompts[i]'s keyword; by default it's read from the prompt, which
+    only works for the "Write 3 lines about Keyword:" formats. prompts is only used
+    for that, so it may be None when keywords is given.
+    Returns one result dict per completion (see score_completion)."""
+    if keywords is None:
+        keywords = [_get_keyword(p) for p in prompts]
+    all_lines = [_extract_haiku_lines_from_response(c) for c in completions]
+    checks = check_many(keywords, ['\n'.join(lines) for lines in all_lines])
+    return [_result_dict(kw, lines, check) for kw, lines, check in zip(keywords, all_lines, checks)]
+
+
+def score_completion(prompt, completion):
+    """Extracts the haiku lines and keyword from a prompt/completion pair and checks them.
+    Returns a dict with per-check pass flags, keyword/syllable counts, the extracted
+    lines, and copied-example-line flags."""
+    return score_completions([prompt], [completion])[0]
+
+
+# columns saved for each generated haiku in results/test_haikus_*.csv
+RESULT_COLUMNS = [
+    "keyword", "lines_ok", "keyword_ok", "syllables_ok",
+    "syllables_l1_ok", "syllables_l2_ok", "syllables_l3_ok", "haiku_ok",
+    "keyword_count", "syllable_counts", "copied_l1", "copied_l2", "copied_l3", "completion",
+]
+
+def result_row(result, completion):
+    """Builds a results row (see RESULT_COLUMNS) from a score_completion dict."""
+    row = {col: result.get(col, False) for col in RESULT_COLUMNS[:-1]}
+    row["completion"] = completion
+    return row
+
+
+# --- Scoreboard ---
+def summarize(df, label):
+    n = len(df)
+    return {
+        "model": label,
+        "n": n,
+        "lines_ok": df["lines_ok"].mean(),
+        "keyword_ok": df["keyword_ok"].mean(),
+        "syllables_ok": df["syllables_ok"].mean(),
+        "syllables_l1_ok": df["syllables_l1_ok"].mean(),
+        "syllables_l2_ok": df["syllables_l2_ok"].mean(),
+        "syllables_l3_ok": df["syllables_l3_ok"].mean(),
+        "haiku_ok": df["haiku_ok"].mean(),
+        "copied_l1": df["copied_l1"].mean(),
+        "copied_l2": df["copied_l2"].mean(),
+        "copied_l3": df["copied_l3"].mean(),
+    }
@@ -0,0 +1,315 @@
+# experiments.py
+"""Stage-cached experiment matrix for SFT format and hyperparameter sweeps.
+
+Runs every combination of format templates x learning rates x epochs x
+early-stopping patience through the stages
+
+    merge -> format -> tokenize -> train -> evaluate -> score
+
+and collects the results in one comparison table. Each stage's output lives in
+cache/experiments/<stage>/<key>/, where key hashes the stage's inputs: the
+upstream stage keys plus its own settings (template, tokenizer, training args,
+generation kwargs, checker versions, ...). A stage whose key already exists is
+skipped, so shared upstream work runs once per sweep (the raw data is merged
+once, each template is formatted and tokenized once however many training
+variants use it) and re-running or extending a sweep only runs what's new.
+
+- merge: data_pipeline.run_pipeline over the raw train/eval haikus (checked,
+  repetitive batches dropped, deduped)
+- format: <split>_data.jsonl in one FORMAT_TEMPLATES template
+- tokenize: sft_data's memory-mapped arrays for the base model's tokenizer
+- train: the sft.ipynb recipe (SFTCollator, length-bucketed batches, early
+  stopping on eval loss), saving the best model
+- evaluate: evaluate_suite on the test keywords, prompting in the template's
+  own format (format_data.template_prompt_fn), stored with results_store
+- score: the stored completions re-scored with the current haiku checks
+
+--tiny runs the whole sweep offline on CPU in a few minutes: the base model is
+generation.make_tiny_model's random GPT-2, and the test suite is 5 keywords
+with 2 short samples each. Run from root:
+    python src/experiments.py --tiny --templates keyword_numbered haiku_plain --learning-rates 1e-3 3e-3 --epochs 1
+    python src/experiments.py --templates keyword_numbered haiku_numbered haiku_line_tags --learning-rates 2e-5 5e-5 --out results/experiments.csv
+"""
+
+
+import os, json, time, shutil, hashlib, argparse, itertools
+import torch
+from transformers import (AutoTokenizer, AutoModelForCausalLM, Trainer, TrainingArguments,
+                          EarlyStoppingCallback)
+from format_data import FORMAT_TEMPLATES, DEFAULT_TEMPLATE, format_record, template_prompt_fn
+from merge_data import raw_train_files, _versions, _file_sha256
+from sft_data import load_sft_dataset, _tokenizer_key
+from sft_collate import SFTCollator, LengthBucketSampler
+from generation import GEN_KW, make_tiny_model, load_model_and_tokenizer, model_fingerprint, evaluate_suite
+from eval_scoring import score_completions, result_row
+from results_store import TABLE_METRICS, aggregate, save_run, load_run
+from test_data_keywords import particle_physics_keywords
+
+
+CACHE_DIR = 'cache/experiments/'
+STAGE_VERSION = 1 # bump when a stage's outputs change for the same inputs
+SPLITS = {'train': None, 'eval': ['data/eval/cosmology.jsonl']} # split -> raw files (train: raw_train_files())
+
+# sft.ipynb's settings; the matrix varies learning_rate, epochs and patience
+DEFAULT_CONFIG = {
+    "base_model": "distilgpt2",
+    "max_length": 256,
+    "batch_size": 8,
+    "gradient_accumulation_steps": 2,
+    "eval_steps": 25,
+    "seed": 0,
+    "keywords": particle_physics_keywords,
+    "n_per_keyword": 8,
+    "eval_batch_size": 32,
+    "gen_kwargs": GEN_KW,
+}
+TINY_CONFIG = {
+    **DEFAULT_CONFIG,
+    "base_model": None, # generation.make_tiny_model()
+    "eval_steps": 20,
+    "keywords": particle_physics_keywords[:5],
+    "n_per_keyword": 2,
+    "gen_kwargs": {**GEN_KW, "max_new_tokens": 24},
+}
+
+
+class BucketedTrainer(Trainer):
+    """Trainer whose training batches hold similar-length examples (as in sft.ipynb)."""
+    def _get_train_sampler(self, *args, **kwargs):
+        return LengthBucketSampler(self.train_dataset.lengths(), self.args.train_batch_size, seed=self.args.seed)
+
+
+class StageCache:
+    """Runs stages whose outputs are cached in cache_dir/<stage>/<key>/ by a hash of
+    their inputs, counting how many ran and how many were reused."""
+
+    def __init__(self, cache_dir=CACHE_DIR, log=print):
+        self.cache_dir = cache_dir
+        self.log = log
+        self.ran = []
+        self.cached = []
+
+    def run(self, stage, inputs, build):
+        """Returns (key, stage directory, metadata) for stage with these inputs, first
+        running build(directory) -> metadata dict unless a cached entry exists."""
+        config = json.dumps({"stage": stage, "version": STAGE_VERSION, "inputs": inputs}, sort_keys=True, default=repr)
+        key = hashlib.sha256(config.encode('utf-8')).hexdigest()[:16]
+        path = os.path.join(self.cache_dir, stage, key)
+        meta_path = os.path.join(path, "stage.json")
+        if os.path.exists(meta_path):
+            self.cached.append((stage, key))
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                return key, path, json.load(f)["outputs"]
+
+        self.log(f"--- {stage} {key} ---")
+        tmp_path = path + ".tmp"
+        if os.path.exists(tmp_path): # left over from an interrupted run
+            shutil.rmtree(tmp_path)
+        os.makedirs(tmp_path)
+        start = time.perf_counter()
+        outputs = build(tmp_path) or {}
+        with open(os.path.join(tmp_path, "stage.json"), 'w', encoding='utf-8') as f:
+            json.dump({"stage": stage, "key": key, "inputs": json.loads(config)["inputs"], "outputs": outputs,
+                       "seconds": time.perf_counter() - start}, f, indent=1)
+        if os.path.exists(path):
+            shutil.rmtree(path)
+        os.replace(tmp_path, path)
+        self.ran.append((stage, key))
+        return key, path, outputs
+
+
+# --- stages ---
+def _merge(out_dir):
+    from data_pipeline import run_pipeline
+
+    stats = {}
+    for split, filenames in SPLITS.items():
+        stats[split] = run_pipeline(filenames or raw_train_files(), os.path.join(out_dir, f"{split}_merged.jsonl"), {},
+                                   deduplicate=True)
+    return stats
+
+
+def _format(merge_dir, template, out_dir):
+    counts = {}
+    for split in SPLITS:
+        counts[split] = 0
+        with open(os.path.join(merge_dir, f"{split}_merged.jsonl"), 'r', encoding='utf-8') as f, \
+             open(os.path.join(out_dir, f"{split}_data.jsonl"), 'w', encoding='utf-8') as outf:
+            for line in f:
+                outf.write(json.dumps(format_record(json.loads(line), template)) + "\n")
+                counts[split] += 1
+    return counts
+
+
+def _tokenize(format_dir, tok, max_length, out_dir):
+    outputs = {}
+    for split in SPLITS:
+        ds = load_sft_dataset(os.path.join(format_dir, f"{split}_data.jsonl"), tok, max_length=max_length, cache_dir=out_dir)
+        outputs[split] = {"examples": len(ds), "tokens": int(ds.lengths().sum())}
+    return outputs
+
+
+def _load_tokenized(format_dir, tokenize_dir, tok, max_length):
+    return {split: load_sft_dataset(os.path.join(format_dir, f"{split}_data.jsonl"), tok,
+                                    max_length=max_length, cache_dir=tokenize_dir) for split in SPLITS}
+
+
+def _train(base_model, tok, datasets, variant, config, out_dir):
+    model = AutoModelForCausalLM.from_pretrained(base_model)
+    # align model + generation configs to the tokenizer, as in sft.ipynb
+    for cfg in (model.config, model.generation_config):
+        cfg.pad_token_id = tok.pad_token_id
+        cfg.eos_token_id = tok.eos_token_id
+        if tok.bos_token_id is not None:
+            cfg.bos_token_id = tok.bos_token_id
+
+    checkpoints = os.path.join(out_dir, "checkpoints")
+    args = TrainingArguments(
+        output_dir=checkpoints,
+        per_device_train_batch_size=config["batch_size"],
+        per_device_eval_batch_size=config["batch_size"],
+        gradient_accumulation_steps=config["gradient_accumulation_steps"],
+        num_train_epochs=variant["epochs"],
+        learning_rate=variant["learning_rate"],
+        eval_strategy="steps",
+        eval_steps=config["eval_steps"],
+        save_steps=config["eval_steps"],
+        save_total_limit=2,
+        logging_steps=config["eval_steps"],
+        fp16=torch.cuda.is_available(),
+        report_to="none",
+        load_best_model_at_end=True,
+        metric_for_best_model="eval_loss",
+        seed=config["seed"],
+        disable_tqdm=True,
+    )
+    trainer = BucketedTrainer(
+        model=model,
+        args=args,
+        train_dataset=datasets["train"],
+        eval_dataset=datasets["eval"],
+        processing_class=tok,
+        data_collator=SFTCollator(tok.pad_token_id),
+        callbacks=[EarlyStoppingCallback(early_stopping_patience=variant["patience"])],
+    )
+    result = trainer.train()
+    trainer.save_model(os.path.join(out_dir, "model"))
+    shutil.rmtree(checkpoints, ignore_errors=True)
+    return {"train_loss": result.training_loss, "best_eval_loss": trainer.state.best_metric,
+            "steps": trainer.state.global_step, "epochs": trainer.state.epoch}
+
+
+def _evaluate(model_dir, template, label, config, out_dir):
+    model, tok = load_model_and_tokenizer(model_dir)
+    df = evaluate_suite(model, tok, template_prompt_fn(template), config["keywords"],
+                        n_per_keyword=config["n_per_keyword"], batch_size=config["eval_batch_size"],
+                        seed=config["seed"], **config["gen_kwargs"])
+    save_run(df, label, run_id="results", store_dir=out_dir, template=template)
+    return {"generated_tokens": df.attrs["generated_tokens"], "saved_tokens": df.attrs["saved_tokens"]}
+
+
+def _score(evaluate_dir, template):
+    import pandas as pd
+
+    df = load_run("results", store_dir=evaluate_dir)
+    prompt_fn = template_prompt_fn(template)
+    completions = list(df["completion"])
+    results = score_completions([prompt_fn(kw) for kw in df["keyword"]], completions, list(df["keyword"]))
+    return aggregate(pd.DataFrame([result_row(r, c) for r, c in zip(results, completions)]))
+
+
+# --- matrix ---
+def variants(learning_rates=(2e-5,), epochs=(10,), patience=(2,)):
+    """Every training-args combination as a list of dicts."""
+    return [{"learning_rate": lr, "epochs": ep, "patience": pat}
+            for lr, ep, pat in itertools.product(learning_rates, epochs, patience)]
+
+
+def run_matrix(templates=(DEFAULT_TEMPLATE,), training_variants=None, config=DEFAULT_CONFIG, cache_dir=CACHE_DIR,
+               log=print):
+    """Runs every template x training variant through all stages (reusing cached
+    stages) and returns the comparison table, one row per experiment."""
+    import pandas as pd
+
+    training_variants = training_variants or variants()
+    cache = StageCache(cache_dir, log)
+    base_model = config["base_model"] or make_tiny_model()
+    tok = AutoTokenizer.from_pretrained(base_model)
+    if tok.pad_token is None: # Trainer needs a pad token for batching
+        tok.pad_token = tok.eos_token
+
+    raw_files = raw_train_files() + SPLITS['eval']
+    merge_key, merge_dir, merge_stats = cache.run(
+        "merge", {"raw": {f: _file_sha256(f) for f in raw_files}, "checks": _versions()}, _merge)
+    base_fingerprint = model_fingerprint(base_model)
+    tokenizer_key = _tokenizer_key(tok)
+
+    rows = []
+    for template in templates:
+        format_key, format_dir, _ = cache.run(
+            "format", {"merge": merge_key, "template": template},
+            lambda out: _format(merge_dir, template, out))
+        tokenize_key, tokenize_dir, token_counts = cache.run(
+            "tokenize", {"format": format_key, "tokenizer": tokenizer_key, "max_length": config["max_length"]},
+            lambda out: _tokenize(format_dir, tok, config["max_length"], out))
+
+        for variant in training_variants:
+            label = f"{template} lr={variant['learning_rate']:g} ep={variant['epochs']:g} pat={variant['patience']}"
+            train_inputs = {"tokenize": tokenize_key, "base_model": base_fingerprint, **variant,
+                            **{k: config[k] for k in ("batch_size", "gradient_accumulation_steps", "eval_steps", "seed")}}
+            train_key, train_dir, train_stats = cache.run(
+                "train", train_inputs,
+                lambda out: _train(base_model, tok, _load_tokenized(format_dir, tokenize_dir, tok, config["max_length"]),
+                                   variant, config, out))
+            eval_inputs = {"train": train_key, "template": template, "keywords": list(config["keywords"]),
+                           **{k: config[k] for k in ("n_per_keyword", "eval_batch_size", "seed", "gen_kwargs")}}
+            eval_key, eval_dir, _ = cache.run(
+                "evaluate", eval_inputs,
+                lambda out: _evaluate(os.path.join(train_dir, "model"), template, label, config, out))
+            _, _, agg = cache.run(
+                "score", {"evaluate": eval_key, "template": template, "checks": _versions()},
+                lambda out: _score(eval_dir, template))
+
+            rows.append({"experiment": label, "template": template, **variant,
+                         "train_examples": token_counts["train"]["examples"],
+                         "steps": train_stats["steps"], "best_eval_loss": train_stats["best_eval_loss"],
+                         "n": agg["n"], **{col: agg[col] / agg["n"] if agg["n"] else float("nan")
+                                           for col, _ in TABLE_METRICS},
+                         "model_dir": os.path.join(train_dir, "model")})
+    log(f"{len(cache.ran)} stage(s) run, {len(cache.cached)} reused from {cache_dir}")
+    return pd.DataFrame(rows)
+
+
+def comparison_table(table):
+    """Markdown table of the experiments' eval loss and pass rates (as in docs/NOTES.md)."""
+    width = max([len("Experiment")] + [len(e) for e in table["experiment"]])
+    header = f"| {'Experiment':<{width}} | Eval loss |" + "".join(f" {h} |" for _, h in TABLE_METRICS)
+    rule = f"|{'-' * (width + 2)}|-----------|" + "".join("-" * (len(h) + 2) + "|" for _, h in TABLE_METRICS)
+    lines = [header, rule]
+    for _, row in table.iterrows():
+        lines.append(f"| {row['experiment']:<{width}} | {row['best_eval_loss']:^9.3f} |"
+                     + "".join(f" {row[col]:^{len(h)}.2f} |" for col, h in TABLE_METRICS))
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a stage-cached SFT format x training-args experiment matrix.")
+    parser.add_argument("--templates", nargs="+", choices=sorted(FORMAT_TEMPLATES), default=[DEFAULT_TEMPLATE])
+    parser.add_argument("--learning-rates", nargs="+", type=float, default=[2e-5])
+    parser.add_argument("--epochs", nargs="+", type=float, default=[10])
+    parser.add_argument("--patience", nargs="+", type=int, default=[2], help="early stopping patience (evals)")
+    parser.add_argument("--tiny", action="store_true", help="tiny random GPT-2 and a 5-keyword test suite (offline, CPU)")
+    parser.add_argument("--cache-dir", default=CACHE_DIR)
+    parser.add_argument("--out", default=None, help="also save the comparison table as CSV")
+    args = parser.parse_args()
+
+    from transformers.utils import logging
+    logging.disable_progress_bar()
+
+    table = run_matrix(args.templates, variants(args.learning_rates, args.epochs, args.patience),
+                       TINY_CONFIG if args.tiny else DEFAULT_CONFIG, args.cache_dir)
+    print()
+    print(comparison_table(table))
+    if args.out:
+        table.to_csv(args.out, index=False)
+        print(f"\nSaved {args.out}")
@@ -0,0 +1,157 @@
+# first_valid.py
+"""Best-of-N "first valid haiku" serving mode.
+
+Instead of scoring a fixed number of samples, candidates for one keyword are
+sampled in parallel batches and every candidate is run through the haiku
+checks (eval_scoring.score_completions) the moment it finishes decoding. The
+first one that passes every check is returned and the rest of its batch is
+cancelled right away. If the sample or time budget runs out first, the
+candidate that passed the most checks is returned instead.
+
+Reported metrics per request are latency-to-first-valid and the number of
+samples started per valid haiku. Run from root:
+    python src/first_valid.py MODEL_DIR quark gluon --batch-size 8 --max-samples 64
+"""
+
+
+import time, argparse
+from generation import HaikuStoppingCriteria, generate_batch, sample_seed, GEN_KW
+from eval_scoring import make_zero_shot_prompt, score_completions
+
+
+def partial_score(result):
+    """Number of checks a scored completion passes (lines, keyword, 3 line syllables)."""
+    return sum(bool(result[k]) for k in
+               ["lines_ok", "keyword_ok", "syllables_l1_ok", "syllables_l2_ok", "syllables_l3_ok"])
+
+
+class FirstValidStoppingCriteria(HaikuStoppingCriteria):
+    """Scores each row as it finishes, remembers the best candidate so far, and
+    cancels the whole batch once a candidate passes or the deadline passes.
+    self.finished marks the rows that finished decoding and were scored; rows
+    cut off by the deadline (or by max_new_tokens) are left for the caller."""
+
+    def __init__(self, tok, keyword, deadline=None, best=None):
+        super().__init__(tok)
+        self.keyword = keyword
+        self.deadline = deadline
+        self.best = best # (score, completion, result) carried over from earlier batches
+        self.checked = 0
+        self.valid = None
+        self.finished = set()
+
+    def __call__(self, input_ids, scores, **kwargs):
+        done = super().__call__(input_ids, scores, **kwargs)
+        if self.deadline is not None and time.perf_counter() >= self.deadline:
+            done[:] = True # stop generate() without marking the cut-off rows finished
+        return done
+
+    def on_finished(self, row, completion):
+        if self.valid is not None:
+            return
+        self.finished.add(row)
+        result = self.score(completion)
+        self.checked += 1
+        self.consider(completion, result)
+        if result["haiku_ok"]:
+            self.valid = (completion, result)
+            self.done[:] = True # cancel the rest of the batch
+
+    def score(self, completion):
+        """Check results for one completion; the keyword is passed in rather than parsed
+        from the prompt, so any prompt_fn works."""
+        return score_completions(None, [completion], [self.keyword])[0]
+
+    def consider(self, completion, result):
+        score = partial_score(result)
+        if self.best is None or score > self.best[0]:
+            self.best = (score, completion, result)
+
+
+def first_valid_haiku(model, tok, keyword, prompt_fn=make_zero_shot_prompt, batch_size=8,
+                      max_samples=64, time_budget=None, seed=0, **gen_kwargs):
+    """Samples candidates for keyword in batches of batch_size until one passes every
+    haiku check, max_samples candidates have been started, or time_budget seconds pass.
+    Returns a dict with the chosen completion and its check results, whether it's valid,
+    the latency in seconds, and how many samples were started and checked."""
+    gen_kwargs = {**GEN_KW, **gen_kwargs}
+    prompt = prompt_fn(keyword)
+    start = time.perf_counter()
+    deadline = start + time_budget if time_budget is not None else None
+
+    best = None
+    started = 0
+    checked = 0
+    valid = None
+    while valid is None and started < max_samples:
+        if deadline is not None and time.perf_counter() >= deadline and best is not None:
+            break # the first batch always runs, so there is a candidate to return
+        n = min(batch_size, max_samples - started)
+        seeds = [sample_seed(seed, prompt_fn.__name__, keyword, started + j) for j in range(n)]
+        stopping = FirstValidStoppingCriteria(tok, keyword, deadline=deadline, best=best)
+        completions = generate_batch(model, tok, [prompt], seeds, num_return_sequences=n,
+                                     stopping=stopping, **gen_kwargs)
+        started += n
+        checked += stopping.checked
+        valid = stopping.valid
+        best = stopping.best
+        if valid is None:
+            # rows cut off by the deadline or max_new_tokens never finished; they still count as candidates
+            for row, completion in enumerate(completions):
+                if row not in stopping.finished:
+                    stopping.consider(completion, stopping.score(completion))
+                    checked += 1
+            best = stopping.best
+
+    if valid is not None:
+        completion, result = valid
+    elif best is not None:
+        _, completion, result = best
+    else:
+        completion, result = None, None
+    return {
+        "keyword": keyword,
+        "valid": valid is not None,
+        "completion": completion,
+        "result": result,
+        "latency": time.perf_counter() - start,
+        "samples_started": started,
+        "samples_checked": checked,
+    }
+
+
+def summarize_first_valid(runs):
+    """Aggregates first_valid_haiku outputs into valid rate, mean latency-to-first-valid,
+    and samples started per valid haiku."""
+    valid = [r for r in runs if r["valid"]]
+    started = sum(r["samples_started"] for r in runs)
+    return {
+        "requests": len(runs),
+        "valid_rate": len(valid) / len(runs) if runs else 0.0,
+        "mean_latency_to_first_valid": sum(r["latency"] for r in valid) / len(valid) if valid else None,
+        "samples_per_valid_haiku": started / len(valid) if valid else None,
+    }
+
+
+if __name__ == "__main__":
+    from generation import load_model_and_tokenizer
+
+    parser = argparse.ArgumentParser(description="Generate the first valid haiku for each keyword.")
+    parser.add_argument("model", help="model name or checkpoint directory")
+    parser.add_argument("keywords", nargs="+")
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--max-samples", type=int, default=64)
+    parser.add_argument("--time-budget", type=float, default=None, help="seconds per keyword")
+    parser.add_argument("--constrain-syllables", action="store_true")
+    args = parser.parse_args()
+
+    model, tok = load_model_and_tokenizer(args.model)
+    runs = []
+    for keyword in args.keywords:
+        run = first_valid_haiku(model, tok, keyword, batch_size=args.batch_size, max_samples=args.max_samples,
+                                time_budget=args.time_budget, constrain_syllables=args.constrain_syllables)
+        runs.append(run)
+        status = "valid" if run["valid"] else "best partial"
+        print(f"\n--- {keyword} ({status}, {run['latency']:.2f}s, {run['samples_started']} samples) ---")
+        print(run["completion"])
+    print(f"\n{summarize_first_valid(runs)}")
@@ -3,28 +3,78 @@
 pairs to JSON objects in training and evaluation data. Purpose is to allow 
 quick experiments with SFT training to see how it depends on data 
 formatting choices. Run from root.
+
+Each format lives in FORMAT_TEMPLATES under a name, so a formatting experiment
+means picking (or registering) a template rather than editing change_format.
+DEFAULT_TEMPLATE is the format that performed best (see docs/NOTES.md).
 """
 
 
 import json
 
 
-def change_format(filename, file_out):
-    open(file_out, "w").close() # Clear the output file first
-    print(f"Re-formatting data from {filename} and saving to {file_out}.")
-    with open(file_out, 'a', encoding='utf-8') as outf:
+def _keyword_numbered(keyword, lines):
+    return ("Write 3 lines about Keyword: " + keyword  + "\n1)\n2)\n3)",
+            "1) " + lines[0] + "\n2) " + lines[1] + "\n3) " + lines[2] + "\n<END>")
+
+def _haiku_numbered(keyword, lines):
+    return ("Write a haiku about " + keyword + ".\n1)\n2)\n3)",
+            "1) " + lines[0] + "\n2) " + lines[1] + "\n3) " + lines[2] + "\n<END>")
+
+def _haiku_line_tags(keyword, lines):
+    return ("Write a haiku about " + keyword + ".\n<LINE1>\n<LINE2>\n<LINE3>\n<END>",
+            "<LINE1> " + lines[0] + "\n<LINE2> " + lines[1] + "\n<LINE3> " + lines[2] + "\n<END>")
+
+def _haiku_plain(keyword, lines):
+    return ("Write a haiku about " + keyword + ".",
+            lines[0] + "\n" + lines[1] + "\n" + lines[2])
+
+
+# template name -> function(keyword, haiku_lines) returning (prompt, response)
+FORMAT_TEMPLATES = {
+    'keyword_numbered': _keyword_numbered, # Write 3 lines about Keyword: ... ( #) in prompt and response, <END> in response)
+    'haiku_numbered': _haiku_numbered, # Write a haiku about ... ( #) in prompt and response, <END> in response)
+    'haiku_line_tags': _haiku_line_tags, # Write a haiku about ... (<LINE#> and <END> in both)
+    'haiku_plain': _haiku_plain, # Write a haiku about ... (no numbers or <END>)
+}
+DEFAULT_TEMPLATE = 'keyword_numbered'
+
+
+def register_template(name, fn):
+    """Adds a format template fn(keyword, haiku_lines) -> (prompt, response) under name."""
+    FORMAT_TEMPLATES[name] = fn
+
+
+def format_record(data, template=DEFAULT_TEMPLATE):
+    """Returns a copy of a raw haiku record with 'prompt' and 'response' added
+    using the named format template."""
+    lines = data['haiku'].strip().split("\n")
+    prompt, response = FORMAT_TEMPLATES[template](data['keyword'], lines)
+    data = dict(data)
+    data['prompt'] = prompt
+    data['response'] = response
+    return data
+
+
+def template_prompt_fn(template):
+    """Test-prompt function (keyword -> prompt) in the named template's prompt format,
+    e.g. for evaluating a model trained on that format. For DEFAULT_TEMPLATE the
+    prompts equal eval_scoring.make_zero_shot_prompt's."""
+    def prompt_fn(keyword):
+        return FORMAT_TEMPLATES[template](keyword, ["", "", ""])[0]
+    prompt_fn.__name__ = f"{template}_prompt" # names the template for per-sample seeds and prefix caching
+    return prompt_fn
+
+
+def change_format(filename, file_out, template=DEFAULT_TEMPLATE):
+    print(f"Re-formatting data from {filename} and saving to {file_out} ({template} format).")
+    with open(file_out, 'w', encoding='utf-8') as outf:
         with open(filename, 'r', encoding='utf-8') as f:
             for line in f:
-                data = json.loads(line)
-                keyword = data['keyword']
-                haiku = data['haiku']
-                lines = haiku.strip().split("\n")
-                # Change 'prompt' and/or 'response' formats used in SFT training here
-                data['prompt'] = "Write 3 lines about Keyword: " + keyword  + "\n1)\n2)\n3)"
-                data['response'] = "1) " + lines[0] + "\n2) " + lines[1] + "\n3) " + lines[2] + "\n<END>"
+                data = format_record(json.loads(line), template)
                 outf.write(json.dumps(data) + "\n")
 
 
 if __name__ == "__main__":
     change_format('data/train/merged.jsonl', 'data/train/train_data.jsonl')
-    change_format('data/eval/merged.jsonl', 'data/eval/eval_data.jsonl')
\ No newline at end of file
+    change_format('data/eval/merged.jsonl', 'data/eval/eval_data.jsonl')
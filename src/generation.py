@@ -0,0 +1,428 @@
+# generation.py
+"""Batched haiku generation and the evaluation harness used by notebooks/test_models.ipynb.
+
+Prompts are generated in left-padded, multi-prompt batches with
+num_return_sequences samples per prompt, so the CPU gets a few large matrix
+multiplies per decoding step instead of one tiny one per sample.
+
+Sampling stays reproducible per sample: every generated sample has its own
+seed (see sample_seed) and is drawn with its own torch.Generator by
+PerSampleSampler, so a sample's tokens don't depend on the batch size or on
+which other samples share its batch (up to floating point differences from
+padding).
+
+Decoding also stops per row as soon as a completion is finished, i.e. it
+has written <END> or started a fourth numbered line (see HaikuStoppingCriteria),
+and the completion is truncated there since scoring ignores what follows.
+
+Prompts built from the same template (e.g. make_few_shot_prompt) share a long
+constant preamble. PrefixCache computes its past_key_values once per model and
+template, and every batch reuses a copy expanded to the batch size, so only the
+keyword-specific suffix of each prompt is prefilled.
+
+With constrain_syllables, decoding is steered onto the 5/7/5 line budgets by
+syllable_constraint.SyllableBudgetProcessor.
+"""
+
+
+import os, re, copy, hashlib, weakref
+import torch
+from transformers import (AutoTokenizer, AutoModelForCausalLM, LogitsProcessor, LogitsProcessorList,
+                          StoppingCriteria, StoppingCriteriaList)
+from eval_scoring import END_TOKEN, score_completion, score_completions, result_row
+from syllable_constraint import SyllableBudgetProcessor
+from merge_data import _file_sha256
+
+
+DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
+DTYPE = torch.float16 if (DEVICE == "cuda") else torch.float32
+
+GEN_KW = dict(max_new_tokens=64, temperature=0.9, top_p=0.95) # fixed generation config for the scoreboard
+
+
+# precision -> weight dtype; int8 loads fp32 weights and quantizes them (see quantize_int8)
+PRECISIONS = {"fp32": torch.float32, "fp16": torch.float16, "bf16": torch.bfloat16, "int8": torch.float32}
+
+
+def _conv1d_to_linear(model):
+    """Replaces GPT-2's Conv1D layers (transposed linear layers) with equivalent
+    nn.Linear ones, which torch's quantization knows how to handle."""
+    from transformers.pytorch_utils import Conv1D
+
+    for module in list(model.modules()):
+        for name, child in module.named_children():
+            if isinstance(child, Conv1D):
+                linear = torch.nn.Linear(child.nx, child.nf, dtype=child.weight.dtype)
+                linear.weight.data = child.weight.data.t().contiguous()
+                linear.bias.data = child.bias.data
+                setattr(module, name, linear)
+    return model
+
+
+def quantize_int8(model):
+    """Dynamic int8 quantization (CPU only) of every linear layer, including the
+    attention/MLP projections and the LM head: weights are stored as int8 and
+    activations are quantized on the fly per batch."""
+    return torch.ao.quantization.quantize_dynamic(_conv1d_to_linear(model), {torch.nn.Linear}, dtype=torch.qint8)
+
+
+def model_fingerprint(model_name_or_path):
+    """A hub model's name, or a hash of every file in a local model directory, so
+    cached results of a checkpoint directory go stale when it is retrained."""
+    if not os.path.isdir(model_name_or_path):
+        return model_name_or_path
+    h = hashlib.sha256()
+    for name in sorted(os.listdir(model_name_or_path)):
+        path = os.path.join(model_name_or_path, name)
+        if os.path.isfile(path):
+            h.update(f"{name}:{_file_sha256(path)}|".encode('utf-8'))
+    return h.hexdigest()
+
+
+def load_model_and_tokenizer(model_name_or_path, precision=None):
+    """Loads a causal LM and its left-padding tokenizer in eval mode. precision is
+    one of PRECISIONS; by default fp16 on CUDA and fp32 on CPU. bf16 runs on any
+    CPU but is only fast on ones with native bf16 support; int8 is CPU only."""
+    precision = precision or ("fp16" if DEVICE == "cuda" else "fp32")
+    if precision not in PRECISIONS:
+        raise ValueError(f"precision must be one of {', '.join(PRECISIONS)}, got {precision!r}")
+    if precision == "int8" and DEVICE == "cuda":
+        raise ValueError("int8 dynamic quantization only runs on CPU")
+
+    tok = AutoTokenizer.from_pretrained(model_name_or_path)
+    if tok.pad_token is None:
+        tok.pad_token = tok.eos_token
+    tok.padding_side = "left" # decoder-only batches must be left-padded so every row ends at the prompt
+
+    model = AutoModelForCausalLM.from_pretrained(
+        model_name_or_path,
+        dtype=PRECISIONS[precision],
+    )
+    model.to(DEVICE)
+    model.eval()
+    if precision == "int8":
+        model = quantize_int8(model)
+    return model, tok
+
+
+TINY_MODEL_DIR = 'cache/tiny_gpt2/'
+
+
+def make_tiny_model(path=TINY_MODEL_DIR, corpus=('data/train/train_data.jsonl',), vocab_size=600,
+                    n_embd=64, n_layer=2, n_head=2, seed=0):
+    """Builds (once) and saves a tiny, randomly initialized GPT-2 whose byte-level BPE
+    tokenizer is trained on the formatted haiku data, so generation, training and
+    benchmarks can run offline on CPU. Returns path, for load_model_and_tokenizer."""
+    if os.path.exists(os.path.join(path, "config.json")):
+        return path
+    import json
+    from tokenizers import ByteLevelBPETokenizer
+    from transformers import PreTrainedTokenizerFast, GPT2Config, GPT2LMHeadModel
+
+    texts = []
+    for filename in corpus:
+        with open(filename, 'r', encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    data = json.loads(line)
+                    texts.append(data['prompt'] + "\n" + data['response'])
+    bpe = ByteLevelBPETokenizer()
+    bpe.train_from_iterator(texts, vocab_size=vocab_size, special_tokens=["<|endoftext|>"], show_progress=False)
+    tok = PreTrainedTokenizerFast(tokenizer_object=bpe._tokenizer, bos_token="<|endoftext|>",
+                                  eos_token="<|endoftext|>", unk_token="<|endoftext|>")
+
+    torch.manual_seed(seed)
+    config = GPT2Config(vocab_size=len(tok), n_positions=512, n_embd=n_embd, n_layer=n_layer, n_head=n_head,
+                        bos_token_id=tok.eos_token_id, eos_token_id=tok.eos_token_id)
+    model = GPT2LMHeadModel(config)
+    tmp_path = path.rstrip("/") + ".tmp"
+    tok.save_pretrained(tmp_path)
+    model.save_pretrained(tmp_path)
+    os.replace(tmp_path, path)
+    return path
+
+
+def sample_seed(base_seed, *coords):
+    """Stable 63-bit seed for one sample from a base seed and its coordinates
+    (e.g. prompt function name, keyword, sample index). Unlike hash(), this is
+    the same in every process and Python session."""
+    text = repr((base_seed,) + tuple(coords))
+    return int.from_bytes(hashlib.sha256(text.encode('utf-8')).digest()[:8], 'little') >> 1
+
+
+class PerSampleSampler(LogitsProcessor):
+    """Temperature + top-p sampling where batch row i draws from its own
+    torch.Generator seeded with seeds[i].
+
+    It must be the last logits processor and generate() must run with
+    do_sample=False: the chosen token gets score 0 and every other token -inf,
+    so greedy decoding picks exactly the sampled token.
+    """
+
+    def __init__(self, seeds, temperature=1.0, top_p=1.0):
+        self.generators = [torch.Generator().manual_seed(int(s)) for s in seeds]
+        self.temperature = temperature
+        self.top_p = top_p
+
+    def __call__(self, input_ids, scores):
+        scores = scores.float() / self.temperature
+        if self.top_p < 1.0:
+            # same rule as transformers' TopPLogitsWarper: drop the low-probability tail
+            # whose total mass is <= 1 - top_p, always keeping the most likely token
+            sorted_scores, sorted_idx = torch.sort(scores, descending=False)
+            cum_probs = sorted_scores.softmax(dim=-1).cumsum(dim=-1)
+            remove = cum_probs <= (1 - self.top_p)
+            remove[:, -1] = False
+            scores = scores.masked_fill(remove.scatter(1, sorted_idx, remove), float("-inf"))
+        probs = scores.softmax(dim=-1).cpu()
+
+        next_tokens = torch.empty(len(self.generators), dtype=torch.long)
+        for i, g in enumerate(self.generators):
+            next_tokens[i] = torch.multinomial(probs[i], 1, generator=g)
+        out = torch.full_like(scores, float("-inf"))
+        out.scatter_(1, next_tokens.to(out.device).unsqueeze(1), 0.0)
+        return out
+
+
+# a line starting with "4)" (or "4." / "4:") means the model has moved past the haiku;
+# "4." followed by a digit is a number ("4.5 billion years"), not a line label
+_FOURTH_LINE_RE = re.compile(r"(?:^|\n)[ \t]*4[ \t]*(?:[\):]|\.(?!\d))")
+
+
+def find_completion_end(completion):
+    """Returns the index where a finished completion should be cut: just after
+    its first <END>, or at the start of a fourth numbered line, whichever comes
+    first. Returns None if the completion isn't finished yet.
+
+    >>> find_completion_end("1) a\\n2) b\\n3) c\\n4) d")
+    14
+    >>> find_completion_end("4.5 billion years\\nok") is None
+    True
+    """
+    ends = []
+    i = completion.find(END_TOKEN)
+    if i != -1:
+        ends.append(i + len(END_TOKEN))
+    m = _FOURTH_LINE_RE.search(completion)
+    if m:
+        ends.append(m.start())
+    return min(ends) if ends else None
+
+
+def truncate_completion(completion):
+    """Drops everything after <END> or from a fourth numbered line onwards."""
+    end = find_completion_end(completion)
+    return completion if end is None else completion[:end]
+
+
+class HaikuStoppingCriteria(StoppingCriteria):
+    """Per-row stopping criterion for batched generation: a row is done once its
+    completion (the tokens after prompt_len) contains <END> or a fourth numbered
+    line. generate() keeps decoding finished rows but replaces their tokens with
+    padding, and stops early once every row is done. Only unfinished rows are
+    decoded to text and checked on each step."""
+
+    def __init__(self, tok, prompt_len=None):
+        self.tok = tok
+        self.prompt_len = prompt_len # set by generate_batch if not known up front
+        self.done = None
+
+    def __call__(self, input_ids, scores, **kwargs):
+        if self.done is None:
+            self.done = torch.zeros(input_ids.shape[0], dtype=torch.bool)
+        rows = (~self.done).nonzero().flatten().tolist()
+        texts = self.tok.batch_decode(input_ids[rows, self.prompt_len:], skip_special_tokens=True)
+        for row, text in zip(rows, texts):
+            end = find_completion_end(text)
+            if end is not None:
+                self.done[row] = True
+                self.on_finished(row, text[:end])
+        return self.done.clone().to(input_ids.device)
+
+    def on_finished(self, row, completion):
+        """Called once for every row as soon as it finishes, with its truncated
+        completion. Subclasses can inspect it and set self.done[:] = True to
+        cancel the rest of the batch."""
+
+
+def template_preamble(prompt_fn):
+    """The constant text every prompt from prompt_fn starts with."""
+    return os.path.commonprefix([prompt_fn("\x00a"), prompt_fn("\x01b")])
+
+
+class PrefixCache:
+    """Cache of prompt-template preambles run through a model, keyed by model and
+    the preamble text itself (lambdas and template closures share a __name__, so the
+    name can't tell templates apart). Each entry is (prefix_ids, past_key_values)
+    or None if the template has no usable preamble. Entries go away with their model."""
+
+    def __init__(self):
+        self._entries = weakref.WeakKeyDictionary() # model -> {preamble: entry}
+
+    def get(self, model, tok, prompt_fn):
+        by_preamble = self._entries.setdefault(model, {})
+        preamble = template_preamble(prompt_fn)
+        if preamble not in by_preamble:
+            by_preamble[preamble] = self._build(model, tok, preamble)
+        return by_preamble[preamble]
+
+    @torch.no_grad()
+    def _build(self, model, tok, preamble):
+        # the preamble's last token could merge with the keyword when the full prompt is
+        # tokenized, so it's left to the suffix
+        prefix_ids = tok(preamble)["input_ids"][:-1]
+        if not prefix_ids:
+            return None
+        out = model(input_ids=torch.tensor([prefix_ids], device=model.device), use_cache=True)
+        return prefix_ids, out.past_key_values
+
+
+PREFIX_CACHE = PrefixCache() # shared by evaluate_suite calls unless another cache is passed
+
+
+def _prefixed_inputs(tok, prompts, prefix, device):
+    """Builds [cached prefix | left-padded suffix] inputs for prompts that all start
+    with the prefix's token ids. Returns None if any prompt doesn't."""
+    prefix_ids, _ = prefix
+    all_ids = tok(prompts)["input_ids"]
+    n = len(prefix_ids)
+    if any(ids[:n] != prefix_ids or len(ids) == n for ids in all_ids):
+        return None
+    suffix_len = max(len(ids) - n for ids in all_ids)
+    input_ids = torch.full((len(prompts), n + suffix_len), tok.pad_token_id, dtype=torch.long)
+    attention_mask = torch.zeros_like(input_ids)
+    input_ids[:, :n] = torch.tensor(prefix_ids)
+    attention_mask[:, :n] = 1
+    for i, ids in enumerate(all_ids):
+        suffix = ids[n:]
+        input_ids[i, n + suffix_len - len(suffix):] = torch.tensor(suffix)
+        attention_mask[i, n + suffix_len - len(suffix):] = 1
+    return {"input_ids": input_ids.to(device), "attention_mask": attention_mask.to(device)}
+
+
+@torch.no_grad()
+def generate_batch(model, tok, prompts, seeds, num_return_sequences=1,
+                   max_new_tokens=64, temperature=0.9, top_p=0.95, logits_processors=(),
+                   stop_at_end=True, stats=None, prefix=None, constrain_syllables=False, stopping=None):
+    """Generates num_return_sequences completions for each prompt in one
+    left-padded batch. seeds has one entry per returned completion, ordered
+    prompt-major (all samples of prompts[0], then prompts[1], ...), which is
+    also the order of the returned completions.
+    With stop_at_end, rows stop decoding once their haiku is finished and
+    completions are truncated there. If a stats dict is given, its
+    'generated_tokens' and 'saved_tokens' (vs. max_new_tokens) are incremented.
+    prefix is an optional PrefixCache entry shared by all prompts; its cached
+    past_key_values are copied and expanded to the batch instead of re-encoding it.
+    constrain_syllables adds a SyllableBudgetProcessor ahead of the sampler.
+    stopping replaces the default HaikuStoppingCriteria with a (subclass) instance."""
+    if len(seeds) != len(prompts) * num_return_sequences:
+        raise ValueError(f"Expected {len(prompts) * num_return_sequences} seeds, got {len(seeds)}.")
+    inputs = _prefixed_inputs(tok, prompts, prefix, model.device) if prefix is not None else None
+    cache_kwargs = {}
+    if inputs is not None:
+        # the padding sits between the cached prefix and the suffixes, and position ids
+        # come from the attention mask, so every row still sees its prompt contiguously
+        past_key_values = copy.deepcopy(prefix[1]) # generate() appends to the cache in place
+        past_key_values.batch_repeat_interleave(len(prompts) * num_return_sequences)
+        cache_kwargs["past_key_values"] = past_key_values
+    else:
+        inputs = tok(prompts, return_tensors="pt", padding=True).to(model.device)
+    # each prompt is tokenized once and its row repeated per sample (greedy generate() rejects
+    # num_return_sequences > 1, and our sampling is greedy from generate()'s point of view)
+    inputs = {k: v.repeat_interleave(num_return_sequences, dim=0) for k, v in inputs.items()}
+    prompt_len = inputs["input_ids"].shape[1]
+    processors = list(logits_processors)
+    if constrain_syllables:
+        processors.append(SyllableBudgetProcessor(tok))
+    processors.append(PerSampleSampler(seeds, temperature=temperature, top_p=top_p))
+    if stopping is None and stop_at_end:
+        stopping = HaikuStoppingCriteria(tok)
+    if stopping is not None:
+        stopping.prompt_len = prompt_len
+    out = model.generate(
+        **inputs,
+        **cache_kwargs,
+        do_sample=False, # sampling happens in PerSampleSampler
+        logits_processor=LogitsProcessorList(processors),
+        stopping_criteria=StoppingCriteriaList([stopping] if stopping is not None else []),
+        max_new_tokens=max_new_tokens,
+        pad_token_id=tok.pad_token_id,
+        eos_token_id=tok.eos_token_id,
+    )
+    gen_ids = out[:, prompt_len:]
+    if stats is not None:
+        # finished rows are filled with pad tokens, so a row's length is up to its first pad
+        is_pad = (gen_ids == tok.pad_token_id).int()
+        lengths = torch.where(is_pad.any(dim=1), is_pad.argmax(dim=1), gen_ids.shape[1])
+        stats['generated_tokens'] = stats.get('generated_tokens', 0) + int(lengths.sum())
+        stats['saved_tokens'] = stats.get('saved_tokens', 0) + int((max_new_tokens - lengths).sum())
+    completions = tok.batch_decode(gen_ids, skip_special_tokens=True)
+    if stop_at_end:
+        completions = [truncate_completion(c) for c in completions]
+    return completions
+
+
+def generate_completion(model, tok, prompt: str, max_new_tokens=64, temperature=0.9, top_p=0.95, seed=None):
+    """Generates a single completion. Without a seed, one is drawn from torch's
+    global RNG so transformers.set_seed() still makes runs reproducible."""
+    if seed is None:
+        seed = int(torch.randint(0, 2**62, (1,)))
+    return generate_batch(model, tok, [prompt], [seed], max_new_tokens=max_new_tokens,
+                          temperature=temperature, top_p=top_p)[0]
+
+
+def gen_and_check(model, tok, prompt: str, **gen_kwargs):
+    completion = generate_completion(model, tok, prompt, **gen_kwargs)
+    result = score_completion(prompt, completion)
+    result["completion"] = completion
+    return result
+
+
+def _suite_batches(keywords, n_per_keyword, batch_size):
+    """Splits the keyword x sample grid into batches of at most batch_size rows.
+    Yields (batch_keywords, sample_indices), every keyword in a batch getting the same samples."""
+    if n_per_keyword <= batch_size:
+        per_batch = batch_size // n_per_keyword
+        for i in range(0, len(keywords), per_batch):
+            yield keywords[i:i + per_batch], range(n_per_keyword)
+    else:
+        for kw in keywords:
+            for start in range(0, n_per_keyword, batch_size):
+                yield [kw], range(start, min(start + batch_size, n_per_keyword))
+
+
+def evaluate_suite(model, tok, prompt_fn, keywords, n_per_keyword=8, batch_size=32, seed=0,
+                   prefix_cache=PREFIX_CACHE, **gen_kwargs):
+    """Generates n_per_keyword completions for every keyword in batches of up to
+    batch_size samples, scores them, and returns one results row per completion
+    (keyword-major, then sample index). Sample j of keyword kw is seeded with
+    sample_seed(seed, prompt_fn.__name__, kw, j), so results are reproducible
+    for any batch_size. Token counts from early stopping are kept in
+    df.attrs['generated_tokens'] and df.attrs['saved_tokens'], next to the run's
+    prompt_fn name, seed, n_per_keyword and gen_kwargs. The prompt template's
+    preamble is encoded once via prefix_cache (pass None to encode full prompts)."""
+    import pandas as pd
+
+    prompts = []
+    prompt_keywords = []
+    completions = []
+    stats = {'generated_tokens': 0, 'saved_tokens': 0}
+    prefix = prefix_cache.get(model, tok, prompt_fn) if prefix_cache is not None else None
+    for batch_keywords, sample_idxs in _suite_batches(list(keywords), n_per_keyword, batch_size):
+        batch_prompts = [prompt_fn(kw) for kw in batch_keywords]
+        seeds = [sample_seed(seed, prompt_fn.__name__, kw, j) for kw in batch_keywords for j in sample_idxs]
+        completions += generate_batch(model, tok, batch_prompts, seeds,
+                                      num_return_sequences=len(sample_idxs), stats=stats,
+                                      prefix=prefix, **gen_kwargs)
+        prompts += [p for p in batch_prompts for _ in sample_idxs]
+        prompt_keywords += [kw for kw in batch_keywords for _ in sample_idxs]
+
+    # score the whole suite in one batch so keyword normalization and syllable lookups are shared
+    # (passing the keywords lets prompt_fn use any prompt format)
+    results = score_completions(prompts, completions, prompt_keywords)
+    rows = [result_row(r, c) for r, c in zip(results, completions)]
+    df = pd.DataFrame(rows)
+    df.attrs.update(stats)
+    # run metadata, e.g. for results_store.save_run
+    df.attrs.update(prompt_fn=prompt_fn.__name__, seed=seed, n_per_keyword=n_per_keyword, gen_kwargs=gen_kwargs)
+    return df
@@ -5,7 +5,12 @@
 
 
 import re
-import pronouncing, syllables
+from collections import namedtuple
+from syllable_lexicon import count_word
+
+
+EXPECTED_SYLLABLES = [5, 7, 5] # standard haiku syllable counts
+CHECKER_VERSION = 1 # bump whenever a check's pass/fail rules change (invalidates cached verdicts)
 
 
 def check_lines(haiku):
@@ -48,25 +53,13 @@ def check_keyword(keyword, haiku):
     
 
 def _count_syllables(word):
-    """Counts syllables in word. Tries to use pronouncing library first which is based
-    on CMUdict, but falls back on syllables if word not available in pronouncing."""
-
-    # we need to be careful about hyphens since some physics keywords contain them
-    # split on hyphen/dash variants first (so non-inertial -> ["non", "inertial"])
-    parts = re.split(r"[-–—−]+", word)
-
-    total = 0
-    for part in parts:
-        part = re.sub(r"[^a-zA-Z']", "", part.lower())
-        if not part:
-            continue
-        phones = pronouncing.phones_for_word(part)
-        # if word not found in pronouncing, fall back on pyphen hyphenation estimate
-        if not phones:
-            total += syllables.estimate(part)
-        else:
-            total += pronouncing.syllable_count(phones[0])
-    return total
+    """Counts syllables in word. Uses the precompiled syllable lexicon, which is
+    based on CMUdict via the pronouncing library and falls back on the syllables
+    estimate if word not available in CMUdict (see syllable_lexicon.py)."""
+
+    # hyphenated physics keywords are split into parts by the lexicon
+    # (so non-inertial -> ["non", "inertial"])
+    return count_word(word)[0]
 
 
 def check_syllables(haiku, givelinetruth = False):
@@ -78,7 +71,7 @@ def check_syllables(haiku, givelinetruth = False):
     
     
     lines = haiku.strip().split("\n")
-    expected_count = [5, 7, 5] # standard haiku syllable counts
+    expected_count = EXPECTED_SYLLABLES
     actual_count = []
     line_truth = []
 
@@ -101,18 +94,74 @@ def check_syllables(haiku, givelinetruth = False):
         return passed, actual_count
     
 
+# Compact result of checking one haiku. line_truth holds the per-line syllable
+# pass flags for the (up to 3) lines in syllable_counts.
+HaikuCheck = namedtuple("HaikuCheck", [
+    "passed", "lines_ok", "keyword_ok", "syllables_ok",
+    "num_lines", "keyword_count", "syllable_counts", "line_truth", "error_message",
+])
+
+
+def _check_normalized(norm_keyword, haiku, syllable_memo):
+    """Runs all 3 checks on a haiku in one pass given an already-normalized keyword.
+    syllable_memo is a dict of word -> syllable count shared across calls."""
+    lines = haiku.strip().split("\n")
+    num_lines = len(lines)
+    lines_ok = num_lines == 3
+
+    keyword_count = _normalize_for_keyword_count(haiku).count(norm_keyword)
+    keyword_ok = keyword_count == 1
+
+    syllable_counts = []
+    line_truth = []
+    for i, line in enumerate(lines[:3]):
+        total = 0
+        for word in line.split():
+            n = syllable_memo.get(word)
+            if n is None:
+                n = syllable_memo[word] = _count_syllables(word)
+            total += n
+        syllable_counts.append(total)
+        line_truth.append(total == EXPECTED_SYLLABLES[i])
+    syllables_ok = all(line_truth)
+
+    failed_checks = []
+    if not lines_ok:
+        failed_checks.append(f"LINE COUNT ERROR: Haiku has {num_lines} lines.")
+    if not keyword_ok:
+        failed_checks.append(f"KEYWORD ERROR: Keyword appears {keyword_count} times.")
+    if not syllables_ok:
+        failed_checks.append(f"SYLLABLE COUNT ERROR: Syllable counts per line: {syllable_counts}.")
+    passed = len(failed_checks) == 0
+    error_message = None if passed else " | ".join(failed_checks)
+
+    return HaikuCheck(passed, lines_ok, keyword_ok, syllables_ok, num_lines,
+                      keyword_count, syllable_counts, line_truth, error_message)
+
+
+def check_haiku_result(keyword, haiku):
+    """Performs all 3 checks on a single haiku, tokenizing it only once.
+    Returns a HaikuCheck record with the counts, per-line flags and error message."""
+    return _check_normalized(_normalize_for_keyword_count(keyword), haiku, {})
+
+
+def check_many(keywords, haikus):
+    """Performs all 3 checks on a batch of haikus, where keywords[i] goes with haikus[i].
+    Keyword normalization and syllable lookups are shared across the whole batch.
+    Returns a list of HaikuCheck records in the same order as haikus."""
+    norm_keywords = {}
+    syllable_memo = {}
+    results = []
+    for keyword, haiku in zip(keywords, haikus):
+        norm_keyword = norm_keywords.get(keyword)
+        if norm_keyword is None:
+            norm_keyword = norm_keywords[keyword] = _normalize_for_keyword_count(keyword)
+        results.append(_check_normalized(norm_keyword, haiku, syllable_memo))
+    return results
+
+
 def check_haiku(keyword, haiku):
     """Performs all 3 checks on a single haiku and compiles useful error message if checks fail.
     Returns (True, None) if all checks pass. If any check fails, returns (False, error_message)."""
-    failed_checks = []
-    if check_lines(haiku)[0] == False:
-        failed_checks.append(f"LINE COUNT ERROR: Haiku has {check_lines(haiku)[1]} lines.")
-    if check_keyword(keyword, haiku)[0] == False:
-        failed_checks.append(f"KEYWORD ERROR: Keyword appears {check_keyword(keyword, haiku)[1]} times.")
-    if check_syllables(haiku)[0] == False:
-      failed_checks.append(f"SYLLABLE COUNT ERROR: Syllable counts per line: {check_syllables(haiku)[1]}.")
-    if len(failed_checks) == 0:
-        return True, None
-    else:
-        error_message = " | ".join(failed_checks)
-        return False, error_message
\ No newline at end of file
+    result = check_haiku_result(keyword, haiku)
+    return result.passed, result.error_message
@@ -0,0 +1,356 @@
+# haiku_server.py
+"""Long-lived local haiku service with dynamic micro-batching.
+
+The models are loaded once with generation.load_model_and_tokenizer and stay
+resident. Generation requests {"keyword", "n", "mode"} from any number of
+concurrent clients are split into one row per sample and queued per (model,
+mode); a batcher starts a generate_batch call as soon as max_batch_size rows
+are waiting or max_wait seconds after the oldest waiting row arrived, so many
+small requests share one batched decode instead of running at batch size 1.
+Batches run one at a time on a single model thread while the event loop keeps
+accepting and queueing requests. Every completion comes back with its
+eval_scoring.score_completion check results.
+
+Sample j of a request is seeded with sample_seed(seed, prompt_fn name, keyword, j)
+as in evaluate_suite, so a request with an explicit seed is reproducible no
+matter which other requests share its batch (without one, a random seed is
+drawn and returned).
+
+Two transports, both JSON and stdlib only:
+- HTTP (default): POST /generate, POST /score, GET /health
+- --stdio: one JSON request per stdin line, {"op": "generate" | "score" | "health",
+  "id": ..., ...}; each response is one stdout line echoing the id, written as
+  soon as it is ready (so possibly out of order)
+
+/score checks externally generated haikus without touching the models:
+{"haikus": [{"keyword": ..., "haiku": ...}, ...]} gets check_haiku's checks
+(a HaikuCheck per haiku) and items with a raw model "completion" instead of a
+"haiku" are scored like generated completions. Run from root:
+    python src/haiku_server.py --model base=distilgpt2 --model sft=models/haiku_bot --port 8008
+    curl -s localhost:8008/generate -d '{"keyword": "quark", "n": 4, "mode": "few_shot"}'
+"""
+
+
+import sys, json, time, random, asyncio, argparse
+from concurrent.futures import ThreadPoolExecutor
+from haiku_check_helpers import check_many
+from eval_scoring import make_zero_shot_prompt, make_few_shot_prompt, score_completions
+from generation import PREFIX_CACHE, GEN_KW, generate_batch, sample_seed
+
+
+MODES = {"zero_shot": make_zero_shot_prompt, "few_shot": make_few_shot_prompt}
+MAX_SAMPLES = 64 # per generation request
+MAX_BODY = 1 << 20 # bytes per HTTP request body
+
+
+class RequestError(ValueError):
+    """A malformed request; reported to the client as a 400."""
+
+
+class MicroBatcher:
+    """Collects rows submitted from concurrent requests into batches of up to
+    max_batch_size rows. A batch is run by run_batch (an async function taking
+    the rows and returning one output per row) once it is full or max_wait
+    seconds after its first row was queued."""
+
+    def __init__(self, run_batch, max_batch_size=32, max_wait=0.01):
+        self.run_batch = run_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.queue = asyncio.Queue()
+        self.batch_sizes = []
+        self._task = None
+
+    async def submit(self, rows):
+        """Queues rows and waits for their outputs (in the same order)."""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+        loop = asyncio.get_running_loop()
+        futures = [loop.create_future() for _ in rows]
+        for row, future in zip(rows, futures):
+            self.queue.put_nowait((row, future))
+        return await asyncio.gather(*futures)
+
+    async def _next_batch(self):
+        batch = [await self.queue.get()]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            if not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+                continue
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        while True:
+            batch = await self._next_batch()
+            # rows of cancelled requests (e.g. a dropped connection) aren't generated
+            batch = [(row, future) for row, future in batch if not future.done()]
+            if not batch:
+                continue
+            self.batch_sizes.append(len(batch))
+            try:
+                outputs = await self.run_batch([row for row, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            for (_, future), output in zip(batch, outputs):
+                if not future.done():
+                    future.set_result(output)
+
+
+class HaikuServer:
+    """Routes generate/score/health requests. models maps a model name to its
+    (model, tokenizer) pair from load_model_and_tokenizer; the first one is the
+    default. gen_kwargs (GEN_KW by default) apply to every batch."""
+
+    def __init__(self, models, max_batch_size=32, max_wait=0.01, constrain_syllables=False, gen_kwargs=None):
+        self.models = models
+        self.default_model = next(iter(models))
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.constrain_syllables = constrain_syllables
+        self.gen_kwargs = {**GEN_KW, **(gen_kwargs or {})}
+        self.batchers = {} # (model name, mode) -> MicroBatcher
+        # one thread runs every batch: torch already spreads a batch over the cores
+        self.model_thread = ThreadPoolExecutor(max_workers=1)
+        self.stats = {"generate_requests": 0, "score_requests": 0, "generated_tokens": 0, "saved_tokens": 0}
+        self.started = time.time()
+
+    def _batcher(self, model_name, mode):
+        key = (model_name, mode)
+        if key not in self.batchers:
+            async def run_batch(rows):
+                return await asyncio.get_running_loop().run_in_executor(
+                    self.model_thread, self._generate_rows, model_name, mode, rows)
+            self.batchers[key] = MicroBatcher(run_batch, self.max_batch_size, self.max_wait)
+        return self.batchers[key]
+
+    def _generate_rows(self, model_name, mode, rows):
+        """Generates and scores one batch of (keyword, seed) rows (on the model thread)."""
+        model, tok = self.models[model_name]
+        prompt_fn = MODES[mode]
+        prompts = [prompt_fn(keyword) for keyword, _ in rows]
+        prefix = PREFIX_CACHE.get(model, tok, prompt_fn)
+        completions = generate_batch(model, tok, prompts, [seed for _, seed in rows], stats=self.stats,
+                                     prefix=prefix, constrain_syllables=self.constrain_syllables,
+                                     **self.gen_kwargs)
+        results = score_completions(prompts, completions)
+        return [{"completion": c, **r} for c, r in zip(completions, results)]
+
+    async def generate(self, request):
+        keyword = request.get("keyword")
+        if not isinstance(keyword, str) or not keyword.strip():
+            raise RequestError("'keyword' must be a non-empty string")
+        n = request.get("n", 1)
+        if not isinstance(n, int) or not 1 <= n <= MAX_SAMPLES:
+            raise RequestError(f"'n' must be an integer from 1 to {MAX_SAMPLES}")
+        mode = request.get("mode", "zero_shot")
+        if mode not in MODES:
+            raise RequestError(f"'mode' must be one of {', '.join(MODES)}")
+        model_name = request.get("model", self.default_model)
+        if model_name not in self.models:
+            raise RequestError(f"'model' must be one of {', '.join(self.models)}")
+        seed = request.get("seed")
+        if seed is None:
+            seed = random.getrandbits(62)
+        elif not isinstance(seed, int):
+            raise RequestError("'seed' must be an integer")
+
+        self.stats["generate_requests"] += 1
+        start = time.perf_counter()
+        rows = [(keyword, sample_seed(seed, MODES[mode].__name__, keyword, j)) for j in range(n)]
+        samples = await self._batcher(model_name, mode).submit(rows)
+        return {"keyword": keyword, "mode": mode, "model": model_name, "seed": seed,
+                "samples": samples, "latency": time.perf_counter() - start}
+
+    async def score(self, request):
+        items = request.get("haikus")
+        if not isinstance(items, list) or not all(isinstance(item, dict) for item in items):
+            raise RequestError("'haikus' must be a list of {keyword, haiku} or {keyword, completion} objects")
+        for item in items:
+            if not isinstance(item.get("keyword"), str) or not isinstance(item.get("haiku", item.get("completion")), str):
+                raise RequestError("every item needs a string 'keyword' and a string 'haiku' or 'completion'")
+        self.stats["score_requests"] += 1
+        # scoring is light but still CPU work, so it runs off the event loop (next to the model thread)
+        results = await asyncio.get_running_loop().run_in_executor(None, self._score_items, items)
+        return {"results": results}
+
+    @staticmethod
+    def _score_items(items):
+        results = [None] * len(items)
+        haikus = [i for i, item in enumerate(items) if "haiku" in item]
+        for i, check in zip(haikus, check_many([items[i]["keyword"] for i in haikus],
+                                               [items[i]["haiku"] for i in haikus])):
+            results[i] = check._asdict()
+        completions = [i for i, item in enumerate(items) if "haiku" not in item]
+        scored = score_completions(None, [items[i]["completion"] for i in completions],
+                                   keywords=[items[i]["keyword"] for i in completions])
+        for i, result in zip(completions, scored):
+            results[i] = result
+        return results
+
+    async def health(self, request=None):
+        batch_sizes = [size for b in self.batchers.values() for size in b.batch_sizes]
+        return {"models": list(self.models), "modes": list(MODES), "uptime": time.time() - self.started,
+                "max_batch_size": self.max_batch_size, "max_wait": self.max_wait,
+                "batches": len(batch_sizes),
+                "mean_batch_size": sum(batch_sizes) / len(batch_sizes) if batch_sizes else None,
+                "queued": sum(b.queue.qsize() for b in self.batchers.values()), **self.stats}
+
+    async def handle(self, op, request):
+        """Runs one request. Returns (status, response dict)."""
+        handlers = {"generate": self.generate, "score": self.score, "health": self.health}
+        if not isinstance(request, dict):
+            return 400, {"error": "malformed request: must be a JSON object"}
+        if op not in handlers:
+            return 404, {"error": f"unknown operation {op!r}"}
+        try:
+            return 200, await handlers[op](request)
+        except RequestError as e:
+            return 400, {"error": str(e)}
+        except Exception as e:
+            return 500, {"error": f"{type(e).__name__}: {e}"}
+
+
+# --- HTTP transport ---
+ROUTES = {"generate": "POST", "score": "POST", "health": "GET"} # operation -> HTTP method
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+           413: "Payload Too Large", 500: "Internal Server Error"}
+
+
+async def _read_http_request(reader):
+    """(method, path, keep_alive, body) of the next request, or None at end of connection."""
+    request_line = await reader.readline()
+    if not request_line.strip():
+        return None
+    method, path, version = request_line.decode('latin-1').split(maxsplit=2)
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode('latin-1').partition(":")
+        headers[name.strip().lower()] = value.strip()
+    length = int(headers.get("content-length", 0))
+    if length > MAX_BODY:
+        raise RequestError("request body too large")
+    body = await reader.readexactly(length) if length else b""
+    keep_alive = version.strip().upper() == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+    return method.upper(), path.split("?")[0], keep_alive, body
+
+
+async def _handle_http(server, reader, writer):
+    try:
+        while True:
+            try:
+                parsed = await _read_http_request(reader)
+            except (ValueError, asyncio.IncompleteReadError) as e:
+                parsed, keep_alive = None, False
+                status, response = (413 if isinstance(e, RequestError) else 400), {"error": str(e) or "bad request"}
+            else:
+                if parsed is None:
+                    break
+                method, path, keep_alive, body = parsed
+                op = path.strip("/")
+                if op not in ROUTES:
+                    status, response = 404, {"error": f"no such path {path}"}
+                elif method != ROUTES[op]:
+                    status, response = 405, {"error": f"{method} not allowed for {path}"}
+                else:
+                    try:
+                        request = json.loads(body) if body else {}
+                    except ValueError as e:
+                        status, response = 400, {"error": f"invalid JSON: {e}"}
+                    else:
+                        status, response = await server.handle(op, request)
+            payload = json.dumps(response).encode('utf-8')
+            writer.write(f"HTTP/1.1 {status} {REASONS[status]}\r\nContent-Type: application/json\r\n"
+                         f"Content-Length: {len(payload)}\r\nConnection: {'keep-alive' if keep_alive else 'close'}"
+                         "\r\n\r\n".encode('latin-1') + payload)
+            await writer.drain()
+            if not keep_alive:
+                break
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+
+async def serve_http(server, host="127.0.0.1", port=8008):
+    http = await asyncio.start_server(lambda r, w: _handle_http(server, r, w), host, port)
+    print(f"Serving {', '.join(server.models)} on http://{host}:{port}", file=sys.stderr)
+    async with http:
+        await http.serve_forever()
+
+
+# --- stdio transport ---
+async def serve_stdio(server):
+    """JSON-lines over stdin/stdout; every request is handled concurrently so
+    they can share micro-batches. Returns at end of input, once all are answered."""
+    loop = asyncio.get_running_loop()
+    tasks = set()
+
+    async def answer(line):
+        try:
+            request = json.loads(line)
+        except ValueError as e:
+            status, response, request = 400, {"error": f"invalid JSON: {e}"}, {}
+        else:
+            op = request.pop("op", "generate") if isinstance(request, dict) else None
+            status, response = await server.handle(op, request) # non-objects get a 400
+        if isinstance(request, dict) and "id" in request:
+            response = {"id": request["id"], **response}
+        sys.stdout.write(json.dumps({"status": status, **response}) + "\n")
+        sys.stdout.flush()
+
+    while True:
+        line = await loop.run_in_executor(None, sys.stdin.readline)
+        if not line:
+            break
+        if line.strip():
+            task = asyncio.create_task(answer(line))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+    if tasks:
+        await asyncio.gather(*tasks)
+
+
+if __name__ == "__main__":
+    from generation import PRECISIONS, load_model_and_tokenizer
+
+    parser = argparse.ArgumentParser(description="Serve haiku generation and scoring with dynamic micro-batching.")
+    parser.add_argument("--model", action="append", default=None,
+                        help="NAME=PATH (or just PATH) of a model to keep loaded; repeatable, the first is the default")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8008)
+    parser.add_argument("--stdio", action="store_true", help="serve JSON lines on stdin/stdout instead of HTTP")
+    parser.add_argument("--max-batch-size", type=int, default=32, help="rows per generation batch")
+    parser.add_argument("--max-wait", type=float, default=0.01,
+                        help="seconds a queued row may wait for its batch to fill (default: 0.01)")
+    parser.add_argument("--max-new-tokens", type=int, default=GEN_KW["max_new_tokens"])
+    parser.add_argument("--constrain-syllables", action="store_true")
+    parser.add_argument("--precision", choices=list(PRECISIONS), default=None,
+                        help="e.g. int8 for dynamic int8 quantization on CPU (see generation.PRECISIONS)")
+    args = parser.parse_args()
+
+    models = {}
+    for spec in args.model or ["sft=models/haiku_bot"]:
+        name, _, path = spec.rpartition("=")
+        models[name or path] = load_model_and_tokenizer(path, args.precision)
+    server = HaikuServer(models, max_batch_size=args.max_batch_size, max_wait=args.max_wait,
+                         constrain_syllables=args.constrain_syllables,
+                         gen_kwargs={"max_new_tokens": args.max_new_tokens})
+    try:
+        asyncio.run(serve_stdio(server) if args.stdio else serve_http(server, args.host, args.port))
+    except KeyboardInterrupt:
+        pass
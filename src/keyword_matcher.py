@@ -0,0 +1,185 @@
+# keyword_matcher.py
+"""Multi-keyword Aho-Corasick matcher over every physics keyword family.
+
+The automaton is compiled once over all training families, the evaluation
+family (cosmology) and the test family (particle physics), with keywords
+normalized exactly like haiku_check_helpers.check_keyword does (lowercase,
+hyphens/dashes to spaces, collapsed whitespace). One linear scan of a text then
+reports every keyword occurrence and the families (and splits) it belongs to,
+so whole corpora can be audited for cross-family leakage in one pass instead
+of keywords x haikus substring scans. Like check_keyword's str.count, matches
+are substrings by default ('electron' is found in 'electrons'); whole_words
+(--whole-words) only reports occurrences that aren't part of a longer word.
+
+Run from root to audit the keyword lists and the raw train/eval haikus:
+    python src/keyword_matcher.py
+    python src/keyword_matcher.py --whole-words   # skip matches inside longer words
+"""
+
+
+import json, argparse
+from collections import namedtuple, deque, Counter, defaultdict
+from functools import lru_cache
+from haiku_check_helpers import _normalize_for_keyword_count
+from train_data_keywords import train_families, train_keyword_families
+from eval_data_keywords import cosmology_keywords
+from test_data_keywords import particle_physics_keywords
+
+
+SPLITS = ['train', 'eval', 'test'] # each split is held out from the ones before it
+# family name -> split
+FAMILY_SPLITS = {**{family: 'train' for family in train_families}, 'cosmology': 'eval', 'particle_physics': 'test'}
+
+# start/end are positions in the normalized text
+KeywordMatch = namedtuple("KeywordMatch", ["start", "end", "keyword", "families"])
+
+
+def keyword_families():
+    """Family name -> list of keywords for every train, eval and test family."""
+    families = dict(zip(train_families, train_keyword_families))
+    families['cosmology'] = cosmology_keywords
+    families['particle_physics'] = particle_physics_keywords
+    return families
+
+
+class KeywordMatcher:
+    """Aho-Corasick automaton over normalized keywords.
+    families maps family name -> keywords; a keyword listed in several families
+    reports all of them."""
+
+    def __init__(self, families):
+        self.families = {}  # normalized keyword -> tuple of family names
+        for family, keywords in families.items():
+            for keyword in keywords:
+                norm = _normalize_for_keyword_count(keyword)
+                if norm and family not in self.families.get(norm, ()):
+                    self.families[norm] = self.families.get(norm, ()) + (family,)
+
+        # goto[state] maps a character to the next state; out[state] lists the keywords ending there
+        self.goto = [{}]
+        self.fail = [0]
+        self.out = [[]]
+        for norm in self.families:
+            state = 0
+            for ch in norm:
+                nxt = self.goto[state].get(ch)
+                if nxt is None:
+                    nxt = len(self.goto)
+                    self.goto[state][ch] = nxt
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.out.append([])
+                state = nxt
+            self.out[state].append(norm)
+
+        # breadth-first failure links; each state inherits the outputs of its failure state
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in self.goto[state].items():
+                queue.append(nxt)
+                f = self.fail[state]
+                while f and ch not in self.goto[f]:
+                    f = self.fail[f]
+                self.fail[nxt] = self.goto[f].get(ch, 0)
+                self.out[nxt] = self.out[nxt] + self.out[self.fail[nxt]]
+
+    def find_normalized(self, norm_text, whole_words=False):
+        """Every (possibly overlapping) keyword occurrence in already-normalized text,
+        ordered by end position. With whole_words, only occurrences not inside a
+        longer word are reported."""
+        matches = []
+        state = 0
+        for i, ch in enumerate(norm_text):
+            while state and ch not in self.goto[state]:
+                state = self.fail[state]
+            state = self.goto[state].get(ch, 0)
+            for keyword in self.out[state]:
+                start, end = i + 1 - len(keyword), i + 1
+                if whole_words and ((start > 0 and norm_text[start - 1].isalnum())
+                                    or (end < len(norm_text) and norm_text[end].isalnum())):
+                    continue
+                matches.append(KeywordMatch(start, end, keyword, self.families[keyword]))
+        return matches
+
+    def find(self, text, whole_words=False):
+        """Every keyword occurrence in text (positions refer to the normalized text)."""
+        return self.find_normalized(_normalize_for_keyword_count(text), whole_words)
+
+    def counts(self, text):
+        """Normalized keyword -> number of non-overlapping occurrences in text, the
+        same count check_keyword gets from str.count."""
+        counts = Counter()
+        last_end = {}
+        for match in sorted(self.find(text), key=lambda m: m.start):
+            if match.start >= last_end.get(match.keyword, 0):
+                counts[match.keyword] += 1
+                last_end[match.keyword] = match.end
+        return counts
+
+
+@lru_cache(maxsize=1)
+def get_matcher():
+    """The matcher over every train, eval and test keyword family (built once)."""
+    return KeywordMatcher(keyword_families())
+
+
+def leaked_matches(text, split, matcher=None, whole_words=False):
+    """Keyword occurrences in text (from split 'train', 'eval' or 'test') of keywords
+    that only belong to held-out splits, e.g. a test keyword in a training haiku.
+    Training keywords in eval/test haikus are expected and not reported."""
+    matcher = matcher or get_matcher()
+    level = SPLITS.index(split)
+    return [m for m in matcher.find(text, whole_words)
+            if all(SPLITS.index(FAMILY_SPLITS[family]) > level for family in m.families)]
+
+
+def audit_keywords(matcher=None, whole_words=False):
+    """Keywords that contain a keyword from a held-out split, e.g. a training keyword
+    containing a test keyword. Returns (keyword, family, match) tuples."""
+    matcher = matcher or get_matcher()
+    overlaps = []
+    for family, keywords in keyword_families().items():
+        for keyword in keywords:
+            for match in leaked_matches(keyword, FAMILY_SPLITS[family], matcher, whole_words):
+                overlaps.append((keyword, family, match))
+    return overlaps
+
+
+def audit_jsonl(filename, split, matcher=None, whole_words=False):
+    """Scans every haiku in a JSONL file of raw haiku records once. Returns
+    (number of haikus, {leaked keyword: [record numbers]})."""
+    matcher = matcher or get_matcher()
+    leaks = defaultdict(list)
+    num_haikus = 0
+    with open(filename, 'r', encoding='utf-8') as f:
+        for record_num, line in enumerate(l for l in f if l.strip()):
+            num_haikus += 1
+            for match in leaked_matches(json.loads(line)['haiku'], split, matcher, whole_words):
+                if not leaks[match.keyword] or leaks[match.keyword][-1] != record_num:
+                    leaks[match.keyword].append(record_num)
+    return num_haikus, dict(leaks)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Audit keywords and haikus for cross-family keyword leakage.")
+    parser.add_argument("--whole-words", action="store_true",
+                        help="skip keywords found inside longer words (e.g. 'quark' in 'quarks')")
+    args = parser.parse_args()
+
+    matcher = get_matcher()
+    print(f"=== {len(matcher.families)} keywords from {len(FAMILY_SPLITS)} families ===")
+    overlaps = audit_keywords(matcher, args.whole_words)
+    for keyword, family, match in overlaps:
+        print(f"Keyword '{keyword}' ({family}) contains '{match.keyword}' ({', '.join(match.families)})")
+    if not overlaps:
+        print("No keyword contains a keyword from a held-out split.")
+
+    files = [('data/train/' + f"{family}.jsonl", 'train') for family in train_families]
+    files.append(('data/eval/cosmology.jsonl', 'eval'))
+    for filename, split in files:
+        num_haikus, leaks = audit_jsonl(filename, split, matcher, args.whole_words)
+        leaked = len(set().union(*leaks.values()))
+        print(f"\n--- {filename} ({split}): {leaked} of {num_haikus} haikus use held-out keywords ---")
+        for keyword, records in sorted(leaks.items(), key=lambda kv: -len(kv[1])):
+            print(f"'{keyword}' ({', '.join(matcher.families[keyword])}): {len(records)} haikus")
@@ -0,0 +1,287 @@
+# line_index.py
+"""Line-level duplicate and memorization index over the haiku corpus.
+
+Every haiku line is normalized with eval_scoring._normalize_line_for_copy_check
+(line number prefix, case, whitespace and punctuation dropped) and indexed two
+ways, both searched with binary search so lookups stay sub-linear:
+- exactly, by a 64-bit hash of the normalized line,
+- approximately, by a MinHash signature of its character 4-gram shingles,
+  split into LSH bands. Lines sharing a band are candidates; their similarity
+  is the fraction of agreeing signature values (an estimate of the Jaccard
+  similarity of their shingle sets).
+
+Two uses:
+- repetitive_batch() catches the generation failure modes from docs/NOTES.md
+  (a batch of 25 haikus sharing first/third lines, or a handful of repeated
+  third lines), which merge_data.py and data_pipeline.py use to reject batches.
+- flag_training_copies() marks generated haiku lines that copy (or nearly
+  copy) a training line, e.g. for SFT completions in results/.
+
+The training-line index is cached in cache/line_index_<key>.npz, keyed by the
+indexed files' contents. Run from root:
+    python src/line_index.py --batches
+    python src/line_index.py --flag results/test_haikus_sft_zeroshot.csv
+"""
+
+
+import os, json, zlib, hashlib, argparse
+import numpy as np
+from eval_scoring import _normalize_line_for_copy_check, _extract_haiku_lines_from_response
+
+
+INDEX_VERSION = 1 # bump when normalization, shingling or hashing changes
+BATCH_CHECK_VERSION = 1 # bump when the repetitive batch rule changes
+CACHE_DIR = 'cache/'
+SHINGLE = 4 # characters per shingle
+NUM_PERM = 64 # MinHash signature length
+BANDS = 16 # LSH bands of NUM_PERM // BANDS values each
+NEAR_THRESHOLD = 0.8 # estimated Jaccard similarity that counts as a near duplicate
+MAX_SHARED = 0.2 # a batch is repetitive if more than this share of its haikus repeat a line
+_PRIME = (1 << 31) - 1
+_rng = np.random.default_rng(20260113)
+_PERM_A = _rng.integers(1, _PRIME, NUM_PERM, dtype=np.int64)
+_PERM_B = _rng.integers(0, _PRIME, NUM_PERM, dtype=np.int64)
+
+
+def _line_hash(norm):
+    return int.from_bytes(hashlib.blake2b(norm.encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+def _shingles(norm):
+    """31-bit hashes of the line's distinct character shingles (padded with spaces
+    so short words still produce one)."""
+    padded = f" {norm} "
+    grams = {padded[i:i + SHINGLE] for i in range(max(1, len(padded) - SHINGLE + 1))}
+    return np.fromiter((zlib.crc32(g.encode('utf-8')) & _PRIME for g in grams), dtype=np.int64, count=len(grams))
+
+
+def minhash_signatures(norms):
+    """(len(norms), NUM_PERM) MinHash signatures, computed for all lines at once."""
+    shingles = [_shingles(norm) for norm in norms]
+    if not shingles:
+        return np.empty((0, NUM_PERM), dtype=np.int64)
+    counts = np.fromiter((len(s) for s in shingles), dtype=np.int64, count=len(shingles))
+    flat = np.concatenate(shingles)
+    hashed = (_PERM_A[:, None] * flat[None, :] + _PERM_B[:, None]) % _PRIME
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    return np.minimum.reduceat(hashed, starts, axis=1).T
+
+
+def _band_keys(signatures):
+    """(n, BANDS) uint64 keys, one per band of each signature."""
+    rows = NUM_PERM // BANDS
+    bands = signatures.reshape(len(signatures), BANDS, rows).astype(np.uint64)
+    keys = np.zeros((len(signatures), BANDS), dtype=np.uint64)
+    for r in range(rows):
+        keys = keys * np.uint64(1000003) + bands[:, :, r] # wraps around mod 2**64
+    return keys
+
+
+class LineIndex:
+    """Normalized haiku lines with exact-hash and MinHash LSH lookups.
+    sources[i] is (file number, record number, line number) of line i, with
+    file numbers indexing files."""
+
+    def __init__(self, norms, sources, files, signatures=None):
+        self.norms = list(norms)
+        self.sources = np.asarray(sources, dtype=np.int64).reshape(-1, 3)
+        self.files = list(files)
+        self.signatures = minhash_signatures(self.norms) if signatures is None else signatures
+        hashes = np.fromiter((_line_hash(n) for n in self.norms), dtype=np.uint64, count=len(self.norms))
+        self._hash_order = np.argsort(hashes, kind='stable')
+        self._hashes = hashes[self._hash_order]
+        keys = _band_keys(self.signatures)
+        self._band_order = np.argsort(keys, axis=0, kind='stable')
+        self._band_keys = np.take_along_axis(keys, self._band_order, axis=0)
+
+    def __len__(self):
+        return len(self.norms)
+
+    def exact(self, norm):
+        """Ids of lines equal to the normalized line norm."""
+        h = np.uint64(_line_hash(norm))
+        lo = np.searchsorted(self._hashes, h, side='left')
+        hi = np.searchsorted(self._hashes, h, side='right')
+        return [int(i) for i in self._hash_order[lo:hi] if self.norms[i] == norm]
+
+    def near(self, norm, threshold=NEAR_THRESHOLD, signature=None):
+        """(id, estimated similarity) of lines at least threshold similar to norm,
+        most similar first. Exact copies have similarity 1.0."""
+        if signature is None:
+            signature = minhash_signatures([norm])[0]
+        keys = _band_keys(signature[None, :])[0]
+        candidates = set()
+        for band in range(BANDS):
+            column = self._band_keys[:, band]
+            lo = np.searchsorted(column, keys[band], side='left')
+            hi = np.searchsorted(column, keys[band], side='right')
+            candidates.update(self._band_order[lo:hi, band].tolist())
+        if not candidates:
+            return []
+        ids = np.fromiter(candidates, dtype=np.int64, count=len(candidates))
+        similarity = (self.signatures[ids] == signature).mean(axis=1)
+        keep = similarity >= threshold
+        ids, similarity = ids[keep], similarity[keep]
+        order = np.argsort(-similarity, kind='stable')
+        return [(int(i), 1.0 if self.norms[i] == norm else float(s)) for i, s in zip(ids[order], similarity[order])]
+
+    def source(self, line_id):
+        """(filename, record number, line number, normalized line) of an indexed line."""
+        file_num, record, line = self.sources[line_id]
+        return self.files[file_num], int(record), int(line), self.norms[line_id]
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        tmp_path = path + ".tmp.npz"
+        np.savez(tmp_path, norms=np.array(self.norms, dtype=str), sources=self.sources,
+                 files=np.array(self.files, dtype=str), signatures=self.signatures,
+                 version=np.array(INDEX_VERSION))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            if int(data['version']) != INDEX_VERSION:
+                raise ValueError(f"{path} was built with line index version {int(data['version'])}")
+            return cls(data['norms'].tolist(), data['sources'], data['files'].tolist(), data['signatures'])
+
+
+def haiku_lines(haiku):
+    """Normalized, non-empty lines of a haiku string."""
+    return [norm for norm in map(_normalize_line_for_copy_check, haiku.split("\n")) if norm]
+
+
+def build_line_index(filenames):
+    """Indexes every line of every haiku in the JSONL files of raw haiku records."""
+    norms, sources = [], []
+    for file_num, filename in enumerate(filenames):
+        with open(filename, 'r', encoding='utf-8') as f:
+            records = [json.loads(line) for line in f if line.strip()]
+        for record_num, data in enumerate(records):
+            for line_num, norm in enumerate(haiku_lines(data['haiku'])):
+                norms.append(norm)
+                sources.append((file_num, record_num, line_num))
+    return LineIndex(norms, sources, filenames)
+
+
+def load_line_index(filenames=('data/train/merged.jsonl',), cache_dir=CACHE_DIR):
+    """Returns the LineIndex for filenames, from cache_dir when the files haven't
+    changed since it was built."""
+    h = hashlib.sha256(f"version={INDEX_VERSION}".encode('utf-8'))
+    for filename in filenames:
+        h.update(filename.encode('utf-8'))
+        with open(filename, 'rb') as f:
+            h.update(hashlib.sha256(f.read()).digest())
+    path = os.path.join(cache_dir, f"line_index_{h.hexdigest()[:16]}.npz")
+    try:
+        return LineIndex.load(path)
+    except (OSError, ValueError):
+        index = build_line_index(list(filenames))
+        try:
+            index.save(path)
+        except OSError:
+            pass # read-only checkout; just use the in-memory index
+        return index
+
+
+# --- Repetitive generation batches ---
+def split_batches(records):
+    """Splits one raw file's records into generation batches: contiguous runs
+    with the same prompt_num. Returns lists of record indices."""
+    batches = []
+    for i, data in enumerate(records):
+        if not batches or data['prompt_num'] != records[batches[-1][-1]]['prompt_num']:
+            batches.append([])
+        batches[-1].append(i)
+    return batches
+
+
+def repeated_line_counts(haikus, threshold=NEAR_THRESHOLD):
+    """For each of the 3 line positions, how many of the haikus have a line there
+    that repeats (exactly or nearly) the same line of another haiku in the list.
+    A batch is small, so its lines are compared all-pairs on their signatures."""
+    norms = []
+    for haiku in haikus:
+        lines = haiku.split("\n")
+        norms.append([_normalize_line_for_copy_check(lines[p]) if p < len(lines) else "" for p in range(3)])
+    signatures = minhash_signatures([norm for row in norms for norm in row]).reshape(len(haikus), 3, NUM_PERM)
+    counts = []
+    for position in range(3):
+        present = [i for i, row in enumerate(norms) if row[position]]
+        sig = signatures[present, position]
+        similarity = (sig[:, None, :] == sig[None, :, :]).mean(axis=2)
+        np.fill_diagonal(similarity, 0.0)
+        counts.append(int((similarity >= threshold).any(axis=1).sum()))
+    return counts
+
+
+def repetitive_batch(haikus, max_shared=MAX_SHARED, threshold=NEAR_THRESHOLD):
+    """True if, at any line position, more than max_shared of the haikus repeat
+    another haiku's line (e.g. a batch sharing its first and third lines)."""
+    return any(count > max_shared * len(haikus) for count in repeated_line_counts(haikus, threshold))
+
+
+def repetitive_records(records, max_shared=MAX_SHARED, threshold=NEAR_THRESHOLD):
+    """Indices of the records (from one raw file) that belong to repetitive batches."""
+    rejected = set()
+    for batch in split_batches(records):
+        if repetitive_batch([records[i]['haiku'] for i in batch], max_shared, threshold):
+            rejected.update(batch)
+    return rejected
+
+
+# --- Memorization of training lines ---
+def training_copies(completion, index, threshold=NEAR_THRESHOLD):
+    """For each of the (up to) 3 haiku lines extracted from a completion, the
+    (line id, similarity) of the closest training line at least threshold similar,
+    or None."""
+    lines = _extract_haiku_lines_from_response(completion)[:3]
+    copies = []
+    for line in lines + [""] * (3 - len(lines)):
+        norm = _normalize_line_for_copy_check(line)
+        matches = index.near(norm, threshold) if norm else []
+        copies.append(matches[0] if matches else None)
+    return copies
+
+
+def flag_training_copies(df, index, threshold=NEAR_THRESHOLD):
+    """Adds train_copy_l1..3 (bool) and train_copy_sim_l1..3 columns to a results
+    DataFrame with a completion column, marking lines that copy a training line."""
+    copies = [training_copies(c, index, threshold) for c in df["completion"].fillna("")]
+    for i in range(3):
+        df[f"train_copy_l{i + 1}"] = [c[i] is not None for c in copies]
+        df[f"train_copy_sim_l{i + 1}"] = [c[i][1] if c[i] is not None else 0.0 for c in copies]
+    return df
+
+
+def _print_batch_audit(filenames):
+    for filename in filenames:
+        with open(filename, 'r', encoding='utf-8') as f:
+            records = [json.loads(line) for line in f if line.strip()]
+        for batch in split_batches(records):
+            counts = repeated_line_counts([records[i]['haiku'] for i in batch])
+            flag = "REPETITIVE" if any(c > MAX_SHARED * len(batch) for c in counts) else "ok"
+            print(f"{filename} prompt_num={records[batch[0]]['prompt_num']} "
+                  f"records {batch[0]}-{batch[-1]}: repeated lines per position {counts} {flag}")
+
+
+if __name__ == "__main__":
+    import pandas as pd
+    from merge_data import raw_train_files
+
+    parser = argparse.ArgumentParser(description="Audit haiku batches for repetition and results for training-line copies.")
+    parser.add_argument("--batches", action="store_true", help="report repeated lines in every raw generation batch")
+    parser.add_argument("--flag", nargs="*", default=[], metavar="CSV",
+                        help="results CSVs whose completions are checked against the training lines")
+    parser.add_argument("--threshold", type=float, default=NEAR_THRESHOLD)
+    args = parser.parse_args()
+
+    if args.batches:
+        _print_batch_audit(raw_train_files() + ['data/eval/cosmology.jsonl'])
+    if args.flag:
+        index = load_line_index()
+        print(f"{len(index)} training lines indexed")
+        for filename in args.flag:
+            df = flag_training_copies(pd.read_csv(filename), index, args.threshold)
+            rates = [df[f"train_copy_l{i}"].mean() for i in (1, 2, 3)]
+            print(f"{filename}: training-line copies per line " + ", ".join(f"{r:.1%}" for r in rates))
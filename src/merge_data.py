@@ -6,72 +6,186 @@ The checks on each haiku are:
 1) it has 3 lines, 
 2) the physics keyword appears verbatim (case-insensitive) once,
 3) it obeys the 5-7-5 syllable count.
+Whole generation batches (runs of records with the same prompt_num) that repeat
+lines across their haikus are also omitted; see line_index.repetitive_batch.
+Run from root; pass --workers N to check files (or chunks of large files) in
+N parallel processes. The merged files are byte-for-byte the same for any N.
+
+Every merge records a manifest (cache/merge_manifest.json) with the content
+hash of each raw file and the good haikus it contributed. With --incremental,
+raw files whose hash and checker/lexicon versions match the manifest reuse
+their cached results and only changed files are re-checked, so regenerating
+one batch and re-merging costs time proportional to that one file.
 """
 
 
-import os, json
-from haiku_check_helpers import check_haiku
+import os, json, hashlib, argparse
+from parallel_check import check_jsonl_files
+from haiku_check_helpers import CHECKER_VERSION
+from syllable_lexicon import LEXICON_VERSION
+from line_index import BATCH_CHECK_VERSION, repetitive_records
+
 
+MANIFEST_PATH = 'cache/merge_manifest.json'
+SEGMENT_DIR = 'cache/merge_segments/' # good-haiku lines contributed by each raw file, by content hash
 
-def _get_good_haikus_from_jsonl(filename, file_out):
-    """Gets all good haikus from a JSONL file and writes them to file_out.
+
+def _write_good_haikus(records, results, outf, rejected=()):
+    """Writes the records whose haikus passed all checks to the open file outf,
+    skipping the record indices in rejected (repetitive batches).
     Returns a tuple of good haikus count and failed haikus count."""
     failed_haikus = 0
     good_haikus = 0
-    with open(file_out, 'a', encoding='utf-8') as outf:
-        with open(filename, 'r', encoding='utf-8') as f:
-            for line in f:
-                data = json.loads(line)
-                keyword = data['keyword']
-                haiku = data['haiku']
-
-                passed, _ = check_haiku(keyword, haiku)
-                if passed:
-                    good_haikus += 1
-                    outf.write(json.dumps(data) + "\n")
-                else:
-                    failed_haikus += 1
-
+    for i, (data, result) in enumerate(zip(records, results)):
+        if i in rejected:
+            continue
+        if result.passed:
+            good_haikus += 1
+            outf.write(json.dumps(data) + "\n")
+        else:
+            failed_haikus += 1
     return good_haikus, failed_haikus
 
 
-def merge_all_haikus():
+def raw_train_files():
+    """All raw .jsonl files in data/train/, in sorted (deterministic) order."""
+    ignore_files = ['merged.jsonl', 'train_data.jsonl']
+    jsonl_files = [f for f in sorted(os.listdir('data/train/')) if f.endswith('.jsonl') and f not in ignore_files]
+    return ['data/train/' + f for f in jsonl_files]
+
+
+def _versions():
+    """Checker, lexicon and batch check versions that cached verdicts are only valid for."""
+    return f"checker={CHECKER_VERSION},lexicon={LEXICON_VERSION},batch={BATCH_CHECK_VERSION}"
+
+
+def _file_sha256(filename):
+    h = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _load_manifest():
+    """Returns the manifest's per-file entries, or {} if it's missing or was
+    written by a different checker/lexicon version."""
+    try:
+        with open(MANIFEST_PATH, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if manifest.get('versions') != _versions():
+        return {}
+    return manifest.get('files', {})
+
+
+def _save_manifest(entries):
+    os.makedirs(os.path.dirname(MANIFEST_PATH), exist_ok=True)
+    with open(MANIFEST_PATH, 'w', encoding='utf-8') as f:
+        json.dump({'versions': _versions(), 'files': entries}, f, indent=1, sort_keys=True)
+    # drop segments no raw file points to anymore
+    keep = {entry['sha256'] + ".jsonl" for entry in entries.values()}
+    for name in os.listdir(SEGMENT_DIR):
+        if name not in keep:
+            os.remove(SEGMENT_DIR + name)
+
+
+def _get_segments(filenames, workers=1, incremental=False):
+    """Gets the good-haiku segment of every raw file, re-checking only files whose
+    content hash isn't in the manifest when incremental is True.
+    Returns ({filename: (good_haikus, failed_haikus, repetitive_haikus, segment_path)}, num_checked)."""
+    hashes = {filename: _file_sha256(filename) for filename in filenames}
+    cached = _load_manifest() if incremental else {}
+
+    entries = {}
+    to_check = []
+    for filename in filenames:
+        entry = cached.get(filename)
+        if entry is not None and entry['sha256'] == hashes[filename] \
+                and os.path.exists(SEGMENT_DIR + entry['sha256'] + ".jsonl"):
+            entries[filename] = entry
+        else:
+            to_check.append(filename)
+
+    os.makedirs(SEGMENT_DIR, exist_ok=True)
+    for filename, records, results in check_jsonl_files(to_check, workers=workers):
+        segment_path = SEGMENT_DIR + hashes[filename] + ".jsonl"
+        rejected = repetitive_records(records)
+        with open(segment_path, 'w', encoding='utf-8') as outf:
+            good_ones, bad_ones = _write_good_haikus(records, results, outf, rejected)
+        entries[filename] = {'sha256': hashes[filename], 'good': good_ones, 'failed': bad_ones,
+                             'repetitive': len(rejected)}
+
+    # keep entries of raw files that weren't part of this merge
+    for filename, entry in cached.items():
+        entries.setdefault(filename, entry)
+    _save_manifest(entries)
+
+    segments = {f: (entries[f]['good'], entries[f]['failed'], entries[f]['repetitive'], SEGMENT_DIR + entries[f]['sha256'] + ".jsonl")
+                for f in filenames}
+    return segments, len(to_check)
+
+
+def _append_segment(segment_path, outf):
+    with open(segment_path, 'r', encoding='utf-8') as f:
+        outf.write(f.read())
+
+
+def merge_all_haikus(workers=1, incremental=False):
     """Gets good haikus from all JSONL files in data/train/ and data/eval/.
     Saves them to merged.jsonl in each data subdirectory.
+    Raw files are checked up front, in parallel if workers > 1; with incremental,
+    files unchanged since the last merge reuse their cached results.
     Assumes it's called from root."""
 
+    train_files = raw_train_files()
+    eval_file = 'data/eval/cosmology.jsonl'
+    segments, num_checked = _get_segments(train_files + [eval_file], workers, incremental)
+
     # First, we merge the training data
     failed_haikus = 0
     good_haikus = 0
+    repetitive_haikus = 0
     file_out = 'data/train/merged.jsonl'
     print("=== Starting training data merge ===")
-    open(file_out, "w").close() # Clear the output file first
-    # find all raw .jsonl files 
-    ignore_files = ['merged.jsonl', 'train_data.jsonl']
-    jsonl_files = [f for f in os.listdir('data/train/') if f.endswith('.jsonl') and f not in ignore_files]
-    for filename in jsonl_files:
-        dirname = 'data/train/'
-        filename = dirname + filename
-        print(f"\n--- Getting haikus from {filename} ---")
-        good_ones, bad_ones = _get_good_haikus_from_jsonl(filename, file_out)
-        good_haikus += good_ones
-        failed_haikus += bad_ones
+    with open(file_out, 'w', encoding='utf-8') as outf: # output file is cleared and opened once
+        for filename in train_files:
+            print(f"\n--- Getting haikus from {filename} ---")
+            good_ones, bad_ones, repeated_ones, segment_path = segments[filename]
+            _append_segment(segment_path, outf)
+            good_haikus += good_ones
+            failed_haikus += bad_ones
+            repetitive_haikus += repeated_ones
     
     print(f"\nFinished training data merge.\n{good_haikus} good haikus found and saved to {file_out}.")
     print(f"{failed_haikus} bad haikus omitted.") 
+    if repetitive_haikus:
+        print(f"{repetitive_haikus} haikus in repetitive batches omitted.")
 
 
     # Next, we merge the evaluation data
     file_out = 'data/eval/merged.jsonl'
     print("=== Starting evaluation data merge ===")
-    open(file_out, "w").close() # Clear the output file first
-    filename = 'data/eval/cosmology.jsonl'
-    print(f"\n--- Getting haikus from {filename} ---")
-    good_haikus, failed_haikus = _get_good_haikus_from_jsonl(filename, file_out)
+    filename = eval_file
+    with open(file_out, 'w', encoding='utf-8') as outf:
+        print(f"\n--- Getting haikus from {filename} ---")
+        good_haikus, failed_haikus, repetitive_haikus, segment_path = segments[filename]
+        _append_segment(segment_path, outf)
 
     print(f"\nFinished evaluation data merge.\n{good_haikus} good haikus found and saved to {file_out}.")
     print(f"{failed_haikus} bad haikus omitted.") 
+    if repetitive_haikus:
+        print(f"{repetitive_haikus} haikus in repetitive batches omitted.")
+
+    if incremental:
+        print(f"\n{num_checked} of {len(segments)} raw files re-checked; the rest reused cached results.")
 
 
 if __name__ == "__main__":
-    merge_all_haikus()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Merge all good training/evaluation haikus.")
+    parser.add_argument("--workers", type=int, default=1, help="number of worker processes (default: 1)")
+    parser.add_argument("--incremental", action="store_true",
+                        help="only re-check raw files that changed since the last merge")
+    args = parser.parse_args()
+    merge_all_haikus(workers=args.workers, incremental=args.incremental)
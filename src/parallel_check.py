@@ -0,0 +1,61 @@
+# parallel_check.py
+"""Checks raw haiku JSONL files with an optional process pool.
+Used by check_data.py and merge_data.py (see their --workers option).
+
+Files are split into chunks of CHUNK_SIZE lines and each chunk is checked with
+haiku_check_helpers.check_many, either in-process (workers <= 1) or across a
+pool of worker processes. Results always come back in file and line order,
+so the output doesn't depend on the number of workers.
+"""
+
+
+import json
+from concurrent.futures import ProcessPoolExecutor
+from haiku_check_helpers import check_many
+
+
+CHUNK_SIZE = 500 # lines per task; small enough to spread one large file over several workers
+
+
+def _check_chunk(lines):
+    """Checks the haikus in a list of raw JSONL lines. Returns a list of HaikuCheck records."""
+    records = [json.loads(line) for line in lines]
+    return check_many([r['keyword'] for r in records], [r['haiku'] for r in records])
+
+
+def _read_chunks(filenames, chunk_size):
+    """Reads every file into memory and splits its lines into chunks.
+    Returns ({filename: lines}, [(filename, chunk_lines), ...])."""
+    file_lines = {}
+    chunks = []
+    for filename in filenames:
+        with open(filename, 'r', encoding='utf-8') as f:
+            lines = f.readlines()
+        file_lines[filename] = lines
+        for start in range(0, len(lines), chunk_size):
+            chunks.append((filename, lines[start:start + chunk_size]))
+    return file_lines, chunks
+
+
+def check_jsonl_files(filenames, workers=1, chunk_size=CHUNK_SIZE):
+    """Checks all haikus in the given JSONL files.
+    Returns a list of (filename, records, results) tuples in the order of filenames,
+    where records are the parsed JSON objects and results the matching HaikuCheck records."""
+    file_lines, chunks = _read_chunks(filenames, chunk_size)
+    chunk_lines = [lines for _, lines in chunks]
+
+    if workers is not None and workers > 1 and len(chunks) > 1:
+        with ProcessPoolExecutor(max_workers=min(workers, len(chunks))) as pool:
+            chunk_results = list(pool.map(_check_chunk, chunk_lines)) # map keeps submission order
+    else:
+        chunk_results = [_check_chunk(lines) for lines in chunk_lines]
+
+    results_by_file = {filename: [] for filename in filenames}
+    for (filename, _), results in zip(chunks, chunk_results):
+        results_by_file[filename].extend(results)
+
+    checked = []
+    for filename in filenames:
+        records = [json.loads(line) for line in file_lines[filename]]
+        checked.append((filename, records, results_by_file[filename]))
+    return checked
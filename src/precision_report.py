@@ -0,0 +1,115 @@
+# precision_report.py
+"""Accuracy-vs-speed report for reduced-precision CPU inference.
+
+Loads a model once per precision (generation.PRECISIONS: fp32, bf16, dynamic
+int8, ...), runs the particle-physics test suite with evaluate_suite in each,
+and reports per precision:
+- model size (serialized state dict, so int8 weights count as packed)
+- load time, generation time, samples/sec and generated tokens/sec
+- every scoreboard pass rate and its change vs. the reference (first) precision
+- the share of completions identical to the reference's
+
+Every precision uses the same per-sample seeds, so the comparison is paired:
+a sample only changes when the lower-precision logits change which token is drawn.
+Run from root:
+    python src/precision_report.py models/haiku_bot
+    python src/precision_report.py distilgpt2 --precisions fp32 int8 --prompt few_shot --out results/precision_base.csv
+"""
+
+
+import io, time, argparse
+import torch
+from generation import PRECISIONS, GEN_KW, load_model_and_tokenizer, evaluate_suite
+from eval_scoring import make_zero_shot_prompt, make_few_shot_prompt
+from results_store import TABLE_METRICS
+from test_data_keywords import particle_physics_keywords
+
+
+PROMPT_FNS = {"zero_shot": make_zero_shot_prompt, "few_shot": make_few_shot_prompt}
+METRICS = ["lines_ok", "keyword_ok", "syllables_l1_ok", "syllables_l2_ok", "syllables_l3_ok", "syllables_ok", "haiku_ok"]
+
+
+def model_size_bytes(model):
+    """Size of the model's serialized state dict (tied weights counted once)."""
+    buffer = io.BytesIO()
+    torch.save(model.state_dict(), buffer)
+    return buffer.tell()
+
+
+def compare_precisions(model_name_or_path, precisions=("fp32", "int8", "bf16"), prompt_fn=make_zero_shot_prompt,
+                       keywords=particle_physics_keywords, n_per_keyword=8, batch_size=32, seed=0, **gen_kwargs):
+    """Evaluates the model in each precision. Returns (report DataFrame with one row
+    per precision, {precision: results DataFrame}); deltas are vs. precisions[0]."""
+    import pandas as pd
+
+    gen_kwargs = {**GEN_KW, **gen_kwargs}
+    rows = []
+    dfs = {}
+    for precision in precisions:
+        start = time.perf_counter()
+        model, tok = load_model_and_tokenizer(model_name_or_path, precision=precision)
+        load_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        df = evaluate_suite(model, tok, prompt_fn, keywords, n_per_keyword=n_per_keyword,
+                            batch_size=batch_size, seed=seed, **gen_kwargs)
+        seconds = time.perf_counter() - start
+        df.attrs.update(model=model_name_or_path, precision=precision)
+        dfs[precision] = df
+
+        rows.append({"precision": precision, "size_mb": model_size_bytes(model) / 2**20,
+                     "load_s": load_seconds, "eval_s": seconds,
+                     "samples_per_s": len(df) / seconds, "tokens_per_s": df.attrs['generated_tokens'] / seconds,
+                     **{m: df[m].mean() for m in METRICS}})
+        del model
+
+    report = pd.DataFrame(rows)
+    reference = dfs[precisions[0]]
+    for m in METRICS:
+        report[m + "_delta"] = report[m] - report.loc[0, m]
+    report["speedup"] = report["samples_per_s"] / report.loc[0, "samples_per_s"]
+    report["same_completion"] = [(dfs[p]["completion"] == reference["completion"]).mean() for p in precisions]
+    return report, dfs
+
+
+def report_table(report):
+    """Markdown table of the report: speed and size, then each scoreboard metric with its delta."""
+    widths = [max(len(heading), 12) + 2 for _, heading in TABLE_METRICS]
+    header = ("| Precision | Size (MB) | Samples/s | Tokens/s | Speedup |"
+              + "".join(f"{h:^{w}}|" for (_, h), w in zip(TABLE_METRICS, widths)) + " Same text |")
+    rule = "|-----------|-----------|-----------|----------|---------|" + "".join("-" * w + "|" for w in widths) + "-----------|"
+    lines = [header, rule]
+    for _, row in report.iterrows():
+        cells = [f" {row['precision']:<9} ", f" {row['size_mb']:>9.1f} ", f" {row['samples_per_s']:>9.2f} ",
+                 f" {row['tokens_per_s']:>8.1f} ", f" {row['speedup']:>6.2f}x "]
+        cells += [f"{row[col]:.2f} ({row[col + '_delta']:+.2f})".center(w) for (col, _), w in zip(TABLE_METRICS, widths)]
+        cells.append(f" {row['same_completion']:>9.2f} ")
+        lines.append("|" + "|".join(cells) + "|")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare test-suite pass rates and speed across inference precisions.")
+    parser.add_argument("model", help="model name or checkpoint directory")
+    parser.add_argument("--precisions", nargs="+", choices=list(PRECISIONS), default=["fp32", "int8", "bf16"],
+                        help="the first one is the reference (default: fp32 int8 bf16)")
+    parser.add_argument("--prompt", choices=list(PROMPT_FNS), default="zero_shot")
+    parser.add_argument("--n-per-keyword", type=int, default=8)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default=None, help="also save the report as CSV")
+    parser.add_argument("--save-runs", action="store_true", help="save each precision's results to the results store")
+    args = parser.parse_args()
+
+    report, dfs = compare_precisions(args.model, args.precisions, PROMPT_FNS[args.prompt],
+                                     n_per_keyword=args.n_per_keyword, batch_size=args.batch_size, seed=args.seed)
+    print(f"\n{args.model} ({args.prompt}), {len(dfs[args.precisions[0]])} haikus per precision, "
+          f"{torch.get_num_threads()} torch threads\n")
+    print(report_table(report))
+    if args.out:
+        report.to_csv(args.out, index=False)
+        print(f"\nSaved {args.out}")
+    if args.save_runs:
+        from results_store import save_run
+        for precision, df in dfs.items():
+            print(f"Saved {precision} as {save_run(df, f'{args.model} {args.prompt} ({precision})')}")
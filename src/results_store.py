@@ -0,0 +1,257 @@
+# results_store.py
+"""Columnar store for evaluation runs and the scoreboard built from it.
+
+Every evaluation run (one model + prompt function over the test keywords) is
+saved to results/runs/<run_id>.npz as typed columns: boolean check flags,
+integer counts, the keyword as category codes, syllable counts as an (n, 3)
+int array (-1 where a line is missing) and the completions as one UTF-8 buffer
+with offsets. results/runs/index.json lists every run with its metadata (model,
+prompt function, generation kwargs, seed, ...) and its aggregates: the number
+of rows passing each check. Adding a run only writes that run's file and its
+index entry, and results/scoreboard_summary.csv, the SCOREBOARD.md table and
+the scoreboard plot are all regenerated from the aggregates alone.
+
+Run from root to rebuild the scoreboard from the stored runs, or first import
+the CSVs written by older versions of test_models.ipynb:
+    python src/results_store.py --import-csvs
+    python src/results_store.py
+"""
+
+
+import os, ast, json, time, argparse
+from decimal import Decimal, ROUND_HALF_UP
+import numpy as np
+from eval_scoring import RESULT_COLUMNS
+
+
+STORE_DIR = 'results/runs/'
+STORE_VERSION = 1
+BOOL_COLUMNS = [
+    "lines_ok", "keyword_ok", "syllables_ok",
+    "syllables_l1_ok", "syllables_l2_ok", "syllables_l3_ok", "haiku_ok",
+    "copied_l1", "copied_l2", "copied_l3",
+]
+# scoreboard metrics in SCOREBOARD.md's table and the plot, with their table headings
+TABLE_METRICS = [
+    ("lines_ok", "3 Lines"), ("keyword_ok", "Keyword"), ("syllables_l1_ok", "1st Syll"),
+    ("syllables_l2_ok", "2nd Syll"), ("syllables_l3_ok", "3rd Syll"), ("haiku_ok", "Haiku pass"),
+]
+
+
+def _index_path(store_dir):
+    return os.path.join(store_dir, "index.json")
+
+
+def load_index(store_dir=STORE_DIR):
+    """Run id -> index entry (metadata and aggregates), in the order runs were added."""
+    try:
+        with open(_index_path(store_dir), 'r', encoding='utf-8') as f:
+            index = json.load(f)
+    except OSError:
+        return {}
+    if index.get('version') != STORE_VERSION:
+        raise ValueError(f"{_index_path(store_dir)} has store version {index.get('version')}, expected {STORE_VERSION}")
+    return index['runs']
+
+
+def _save_index(runs, store_dir):
+    path = _index_path(store_dir)
+    with open(path + ".tmp", 'w', encoding='utf-8') as f:
+        json.dump({'version': STORE_VERSION, 'runs': runs}, f, indent=1)
+    os.replace(path + ".tmp", path)
+
+
+def _to_columns(df):
+    """Typed numpy columns for a results DataFrame (see eval_scoring.RESULT_COLUMNS)."""
+    columns = {col: df[col].to_numpy(dtype=bool) for col in BOOL_COLUMNS}
+    columns["keyword_count"] = df["keyword_count"].to_numpy(dtype=np.int16)
+
+    categories, codes = np.unique(df["keyword"].to_numpy(dtype=str), return_inverse=True)
+    columns["keyword_codes"] = codes.astype(np.int32)
+    columns["keyword_categories"] = categories
+
+    syllables = np.full((len(df), 3), -1, dtype=np.int16)
+    for i, counts in enumerate(df["syllable_counts"]):
+        counts = ast.literal_eval(counts) if isinstance(counts, str) else counts
+        syllables[i, :len(counts)] = counts[:3]
+    columns["syllable_counts"] = syllables
+
+    encoded = [str(c).encode('utf-8') if c == c else b"" for c in df["completion"]] # NaN -> ""
+    columns["completion_offsets"] = np.concatenate([[0], np.cumsum([len(e) for e in encoded])]).astype(np.int64)
+    columns["completion_bytes"] = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+    return columns
+
+
+def aggregate(df):
+    """Per-run aggregates: row count and the number of rows passing each check."""
+    return {"n": int(len(df)), **{col: int(df[col].astype(bool).sum()) for col in BOOL_COLUMNS}}
+
+
+def save_run(df, label, run_id=None, store_dir=STORE_DIR, **metadata):
+    """Saves a results DataFrame as a run and adds it (with its aggregates) to the
+    index. label is the scoreboard name; metadata (model, prompt_fn, gen_kwargs,
+    seed, display name for SCOREBOARD.md, ...) is stored as given, with defaults
+    taken from df.attrs as set by generation.evaluate_suite. Saving under an
+    existing run_id replaces that run. Returns the run id."""
+    os.makedirs(store_dir, exist_ok=True)
+    runs = load_index(store_dir)
+    if run_id is None:
+        run_id = f"run_{len(runs):04d}"
+        while run_id in runs:
+            run_id += "_"
+
+    meta = {k: v for k, v in df.attrs.items() if k not in ("generated_tokens", "saved_tokens")}
+    meta.update(metadata)
+    meta = json.loads(json.dumps(meta, default=repr)) # e.g. logits processor objects in gen_kwargs
+    path = os.path.join(store_dir, run_id + ".npz")
+    np.savez_compressed(path + ".tmp.npz", **_to_columns(df))
+    os.replace(path + ".tmp.npz", path)
+
+    runs[run_id] = {"label": label, "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+                    "metadata": meta, "aggregates": aggregate(df)}
+    _save_index(runs, store_dir)
+    return run_id
+
+
+def load_run(run_id, store_dir=STORE_DIR):
+    """The stored run as a results DataFrame with RESULT_COLUMNS (syllable_counts as lists)."""
+    import pandas as pd
+
+    with np.load(os.path.join(store_dir, run_id + ".npz")) as data:
+        columns = {k: data[k] for k in data.files}
+    offsets = columns["completion_offsets"]
+    buffer = columns["completion_bytes"].tobytes()
+    syllables = columns["syllable_counts"]
+    df = pd.DataFrame({
+        "keyword": columns["keyword_categories"][columns["keyword_codes"]],
+        **{col: columns[col] for col in BOOL_COLUMNS},
+        "keyword_count": columns["keyword_count"].astype(int),
+        "syllable_counts": [[int(c) for c in row if c >= 0] for row in syllables],
+        "completion": [buffer[offsets[i]:offsets[i + 1]].decode('utf-8') for i in range(len(offsets) - 1)],
+    })
+    return df[RESULT_COLUMNS]
+
+
+def import_csv(filename, label, run_id=None, store_dir=STORE_DIR, **metadata):
+    """Adds a results/test_haikus_*.csv file from before the store as a run."""
+    import pandas as pd
+
+    df = pd.read_csv(filename, keep_default_na=False)
+    return save_run(df, label, run_id=run_id, store_dir=store_dir, source=filename, **metadata)
+
+
+# --- Scoreboard from aggregates ---
+def scoreboard(run_ids=None, store_dir=STORE_DIR):
+    """Scoreboard summary (the columns of eval_scoring.summarize) for the given runs,
+    or every stored run, computed from the index aggregates only."""
+    import pandas as pd
+
+    runs = load_index(store_dir)
+    rows = []
+    for run_id in (run_ids if run_ids is not None else runs):
+        agg = runs[run_id]["aggregates"]
+        n = agg["n"]
+        rows.append({"model": runs[run_id]["label"], "n": n,
+                     **{col: agg[col] / n if n else float("nan") for col in BOOL_COLUMNS}})
+    return pd.DataFrame(rows, columns=["model", "n"] + BOOL_COLUMNS)
+
+
+def _rate(count, n):
+    """count/n to 2 decimals, rounding halves up (0.565 -> 0.57)."""
+    return str((Decimal(count) / Decimal(n)).quantize(Decimal("0.01"), rounding=ROUND_HALF_UP))
+
+
+def scoreboard_table(run_ids=None, store_dir=STORE_DIR):
+    """The "Pass Rates by Model" markdown table for SCOREBOARD.md."""
+    runs = load_index(store_dir)
+    widths = [len(heading) + 2 for _, heading in TABLE_METRICS]
+    header = "| Model              |" + "".join(f"{h:^{w}}|" for (_, h), w in zip(TABLE_METRICS, widths))
+    rule = "|--------------------|" + "".join("-" * w + "|" for w in widths)
+    lines = [header, rule]
+    for run_id in (run_ids if run_ids is not None else runs):
+        run = runs[run_id]
+        name = run["metadata"].get("display", run["label"])
+        agg = run["aggregates"]
+        lines.append(f"| {name:<18} |" + "".join(f"{_rate(agg[col], agg['n']):^{w}}|"
+                                                  for (col, _), w in zip(TABLE_METRICS, widths)))
+    return "\n".join(lines)
+
+
+def update_scoreboard_md(table, path='results/SCOREBOARD.md'):
+    """Replaces the table under "### Pass Rates by Model" in SCOREBOARD.md."""
+    with open(path, 'r', encoding='utf-8') as f:
+        lines = f.read().split("\n")
+    start = lines.index("### Pass Rates by Model") + 2 # heading, blank line, then the table
+    end = start
+    while end < len(lines) and lines[end].startswith("|"):
+        end += 1
+    lines[start:end] = table.split("\n")
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write("\n".join(lines))
+
+
+def plot_scoreboard(summary, path='results/haiku_scoreboard.png', exclude=("distilgpt2 (zero-shot)",)):
+    """Bar chart of the scoreboard pass rates by model (models in exclude are left out)."""
+    import matplotlib.pyplot as plt
+
+    metrics = [col for col, _ in TABLE_METRICS]
+    summary_plot = summary[~summary["model"].isin(exclude)].reset_index(drop=True)
+
+    x = np.arange(len(summary_plot["model"]))
+    width = 0.12
+
+    fig, ax = plt.subplots(figsize=(11, 4))
+    for i, m in enumerate(metrics):
+        ax.bar(x + (i - 1.5)*width, summary_plot[m].values, width, label=m)
+
+    ax.set_xticks(x)
+    ax.set_xticklabels(summary_plot["model"], rotation=15, ha="right")
+    ax.set_ylim(0, 1.0)
+    ax.set_ylabel("Pass rate")
+    ax.set_title("Haiku checks: pass rate by model/prompting")
+    ax.legend()
+    fig.tight_layout()
+
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    fig.savefig(path, dpi=300, bbox_inches="tight", facecolor="white")
+    return fig
+
+
+def write_scoreboard(run_ids=None, store_dir=STORE_DIR, plot=True):
+    """Regenerates results/scoreboard_summary.csv, the SCOREBOARD.md table and
+    (if plot) the scoreboard plot from the stored aggregates. Returns the summary."""
+    summary = scoreboard(run_ids, store_dir)
+    summary.to_csv("results/scoreboard_summary.csv", index=False)
+    update_scoreboard_md(scoreboard_table(run_ids, store_dir))
+    if plot:
+        plot_scoreboard(summary)
+    return summary
+
+
+# runs saved by test_models.ipynb before the store existed
+# (same run ids as the notebook uses, so re-running it replaces these)
+LEGACY_CSVS = [
+    ("results/test_haikus_base_zeroshot.csv", "base_zeroshot", "distilgpt2 (zero-shot)",
+     {"display": "Base (0-shot)", "model": "distilgpt2", "prompt_fn": "make_zero_shot_prompt"}),
+    ("results/test_haikus_base_fewshot.csv", "base_fewshot", "distilgpt2 (few-shot)",
+     {"display": "Base (few-shot)", "model": "distilgpt2", "prompt_fn": "make_few_shot_prompt"}),
+    ("results/test_haikus_sft_zeroshot.csv", "sft_zeroshot", "SFT model (zero-shot)",
+     {"display": "SFT (0-shot)", "model": "models/haiku_bot", "prompt_fn": "make_zero_shot_prompt"}),
+]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rebuild the scoreboard from the stored evaluation runs.")
+    parser.add_argument("--import-csvs", action="store_true",
+                        help="first import the results/test_haikus_*.csv files as runs")
+    parser.add_argument("--runs", nargs="*", default=None, help="run ids to put on the scoreboard (default: all)")
+    parser.add_argument("--no-plot", action="store_true")
+    args = parser.parse_args()
+
+    if args.import_csvs:
+        for filename, run_id, label, metadata in LEGACY_CSVS:
+            import_csv(filename, label, run_id=run_id, n_per_keyword=8, **metadata)
+            print(f"Imported {filename} as {run_id}")
+    for run_id, run in load_index().items():
+        print(f"{run_id}: {run['label']} ({run['aggregates']['n']} haikus)")
+    print(write_scoreboard(args.runs, plot=not args.no_plot))
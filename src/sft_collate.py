@@ -0,0 +1,247 @@
+# sft_collate.py
+"""Length-bucketed and packed batching for SFT on the sft_data.py arrays.
+
+Two ways to cut down on pad tokens, which dominate CPU training time when a
+batch is padded out to its longest haiku:
+- LengthBucketSampler orders examples so every batch holds similar lengths
+  (pass it to a DataLoader as sampler=, or return it from a Trainer's
+  _get_train_sampler).
+- PackedSFT concatenates whole examples into rows of up to max_length tokens.
+  Each example's position_ids restart at 0, and SFTCollator gives packed
+  batches an explicit 4D block-diagonal causal attention mask, so no token
+  attends across examples and each example's loss equals its loss when run
+  alone (see check_packed_loss). The prompt tokens of every packed example keep
+  their -100 labels, so no token is ever trained to predict the start of the
+  next example.
+
+SFTCollator pads either kind of item with array operations (one concatenate
+and one masked assignment per field) instead of per-row list padding.
+
+Run from root to compare the pad overhead of each mode:
+    python src/sft_collate.py data/train/train_data.jsonl --tokenizer distilgpt2
+"""
+
+
+import math, argparse
+import numpy as np
+import torch
+from sft_data import IGNORE_INDEX
+
+
+class SFTCollator:
+    """Pads a list of SFT items (dicts of 1D input_ids / labels arrays, plus
+    position_ids for packed rows) into a batch of tensors. Padded batches get
+    a 2D attention_mask. Packed batches get position_ids and a 4D additive
+    attention mask of shape (batch, 1, width, width) in mask_dtype (the model's
+    dtype): 0 where a token may attend (earlier tokens of its own example) and
+    the dtype's minimum elsewhere. The pad tail is a sequence of its own.
+    transformers only derives such a mask from position_ids in some code paths
+    (not with the default use_cache=True), so it is built explicitly."""
+
+    def __init__(self, pad_token_id, pad_to_multiple_of=None, mask_dtype=torch.float32):
+        self.pad_token_id = pad_token_id
+        self.pad_to_multiple_of = pad_to_multiple_of
+        self.mask_dtype = mask_dtype
+
+    def __call__(self, batch):
+        lengths = np.fromiter((len(ex["input_ids"]) for ex in batch), dtype=np.int64, count=len(batch))
+        width = int(lengths.max())
+        if self.pad_to_multiple_of:
+            width = self.pad_to_multiple_of * math.ceil(width / self.pad_to_multiple_of)
+        columns = np.arange(width)
+        mask = columns < lengths[:, None] # True on real tokens, row-major like the concatenation
+
+        def pad(key, fill):
+            out = np.full((len(batch), width), fill, dtype=np.int64)
+            out[mask] = np.concatenate([ex[key] for ex in batch])
+            return torch.from_numpy(out)
+
+        features = {
+            "input_ids": pad("input_ids", self.pad_token_id),
+            "labels": pad("labels", IGNORE_INDEX),
+        }
+        if "position_ids" in batch[0]:
+            position_ids = columns[None, :] - lengths[:, None] # pad tail counts up from 0
+            position_ids[mask] = np.concatenate([ex["position_ids"] for ex in batch])
+            features["position_ids"] = torch.from_numpy(position_ids)
+            features["attention_mask"] = self._block_causal_mask(position_ids)
+        else:
+            features["attention_mask"] = torch.from_numpy(mask.astype(np.int64))
+        return features
+
+
+    def _block_causal_mask(self, position_ids):
+        # a new example (segment) starts wherever the position ids restart at 0
+        segments = np.cumsum(position_ids == 0, axis=1)
+        columns = np.arange(position_ids.shape[1])
+        allowed = (segments[:, :, None] == segments[:, None, :]) & (columns[None, :, None] >= columns[None, None, :])
+        mask = torch.zeros(allowed.shape, dtype=self.mask_dtype)
+        mask.masked_fill_(torch.from_numpy(~allowed), torch.finfo(self.mask_dtype).min)
+        return mask[:, None, :, :]
+
+
+class LengthBucketSampler(torch.utils.data.Sampler):
+    """Yields example indices so that consecutive runs of batch_size have similar
+    lengths: a random permutation is cut into groups of bucket_batches batches,
+    each group is sorted by length, and the resulting full batches are shuffled.
+    Reshuffles every epoch (each new iteration, or after set_epoch)."""
+
+    def __init__(self, lengths, batch_size, bucket_batches=50, shuffle=True, seed=0):
+        self.lengths = np.asarray(lengths)
+        self.batch_size = batch_size
+        self.bucket_batches = bucket_batches
+        self.shuffle = shuffle
+        self.seed = seed
+        self.epoch = 0
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def __len__(self):
+        return len(self.lengths)
+
+    def __iter__(self):
+        n = len(self.lengths)
+        rng = np.random.default_rng([self.seed, self.epoch])
+        self.epoch += 1
+        order = rng.permutation(n) if self.shuffle else np.arange(n)
+        # sort by length (longest first) within each bucket of bucket_batches batches
+        bucket = np.arange(n) // (self.batch_size * self.bucket_batches)
+        order = order[np.lexsort((-self.lengths[order], bucket))]
+        num_full = n // self.batch_size
+        full = order[:num_full * self.batch_size].reshape(num_full, self.batch_size)
+        if self.shuffle:
+            full = full[rng.permutation(num_full)]
+        # the one partial batch stays last so every run of batch_size stays a bucketed batch
+        return iter(np.concatenate([full.ravel(), order[num_full * self.batch_size:]]).tolist())
+
+
+def pack_examples(lengths, max_length):
+    """First-fit-decreasing bin packing of example lengths into rows of at most
+    max_length tokens. Returns (row, start) arrays giving each example's row and
+    its offset within that row."""
+    lengths = np.asarray(lengths)
+    if len(lengths) and lengths.max() > max_length:
+        raise ValueError(f"an example has {lengths.max()} tokens, more than max_length={max_length}")
+    row = np.empty(len(lengths), dtype=np.int64)
+    start = np.empty(len(lengths), dtype=np.int64)
+    used = np.zeros(len(lengths), dtype=np.int64) # tokens used per row (at most one row per example)
+    num_rows = 0
+    for i in np.argsort(-lengths, kind='stable'):
+        fits = np.flatnonzero(used[:num_rows] + lengths[i] <= max_length)
+        r = fits[0] if len(fits) else num_rows
+        num_rows = max(num_rows, r + 1)
+        row[i], start[i] = r, used[r]
+        used[r] += lengths[i]
+    return row, start
+
+
+class PackedSFT(torch.utils.data.Dataset):
+    """Dataset of packed rows built from an sft_data.SFTArrays dataset. Items are
+    dicts of input_ids, labels and position_ids arrays for use with SFTCollator.
+    The packing is computed once up front; shuffle it by building a new
+    PackedSFT with another seed."""
+
+    def __init__(self, arrays, max_length=256, seed=0):
+        self.arrays = arrays
+        # shuffle before packing so rows mix examples from across the file
+        example = np.random.default_rng(seed).permutation(len(arrays))
+        lengths = arrays.lengths()[example]
+        row, start = pack_examples(lengths, max_length)
+
+        # lay every token out row by row: its source index in the flat arrays and its position
+        order = np.lexsort((start, row))
+        row, example, lengths = row[order], example[order], lengths[order]
+        token_start = np.concatenate([[0], np.cumsum(lengths)[:-1]]) # of each example in the flat layout
+        within = np.arange(lengths.sum()) - np.repeat(token_start, lengths)
+        self.source = np.repeat(arrays.offsets[example], lengths) + within
+        self.position_ids = within
+        rows = np.bincount(row, weights=lengths, minlength=row.max() + 1 if len(row) else 0)
+        self.row_offsets = np.concatenate([[0], np.cumsum(rows)]).astype(np.int64)
+
+    def __len__(self):
+        return len(self.row_offsets) - 1
+
+    def lengths(self):
+        return np.diff(self.row_offsets)
+
+    def __getitem__(self, i):
+        start, end = self.row_offsets[i], self.row_offsets[i + 1]
+        source = self.source[start:end]
+        return {
+            "input_ids": self.arrays.input_ids[source],
+            "labels": self.arrays.labels[source],
+            "position_ids": self.position_ids[start:end],
+        }
+
+
+@torch.no_grad()
+def check_packed_loss(model, arrays, max_length=256, num_rows=4, atol=1e-4):
+    """Checks that packing doesn't change the loss: runs the first num_rows packed
+    rows of arrays through model and compares every packed example's summed
+    token loss with the same example run alone. Returns the largest absolute
+    difference; raises AssertionError if it is above atol."""
+    packed = PackedSFT(arrays, max_length=max_length)
+    collator = SFTCollator(model.config.pad_token_id or 0, mask_dtype=model.dtype)
+    model.eval()
+
+    def token_losses(features):
+        features = {k: v.to(model.device) for k, v in features.items()}
+        logits = model(**{k: v for k, v in features.items() if k != "labels"}).logits.float()
+        labels = features["labels"][:, 1:]
+        losses = torch.nn.functional.cross_entropy(logits[:, :-1].transpose(1, 2), labels.clamp(min=0), reduction="none")
+        return (losses * (labels != IGNORE_INDEX)).cpu()
+
+    worst = 0.0
+    for i in range(min(num_rows, len(packed))):
+        row = packed[i]
+        losses = token_losses(collator([row]))[0]
+        starts = np.flatnonzero(row["position_ids"] == 0).tolist() + [len(row["input_ids"])]
+        for start, end in zip(starts[:-1], starts[1:]):
+            alone = {k: v[start:end] for k, v in row.items() if k != "position_ids"}
+            alone_loss = float(token_losses(collator([alone]))[0].sum())
+            # the packed example's tokens predict positions start+1..end-1 (the last one predicts the next example)
+            packed_loss = float(losses[start:end - 1].sum())
+            worst = max(worst, abs(packed_loss - alone_loss))
+    if worst > atol:
+        raise AssertionError(f"packed and unpacked example losses differ by up to {worst:.3g}")
+    return worst
+
+
+def epoch_token_counts(lengths, batches):
+    """(real tokens, padded tokens) over an epoch of batches of item indices."""
+    lengths = np.asarray(lengths)
+    real = int(lengths.sum())
+    padded = sum(int(lengths[b].max()) * len(b) for b in batches)
+    return real, padded
+
+
+def _batches(order, batch_size):
+    order = np.asarray(list(order))
+    return [order[i:i + batch_size] for i in range(0, len(order), batch_size)]
+
+
+if __name__ == "__main__":
+    from transformers import AutoTokenizer
+    from sft_data import load_sft_dataset
+
+    parser = argparse.ArgumentParser(description="Compare pad overhead of random, length-bucketed and packed batches.")
+    parser.add_argument("filename", help="formatted SFT data, e.g. data/train/train_data.jsonl")
+    parser.add_argument("--tokenizer", default="distilgpt2")
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--max-length", type=int, default=256)
+    args = parser.parse_args()
+
+    tokenizer = AutoTokenizer.from_pretrained(args.tokenizer)
+    ds = load_sft_dataset(args.filename, tokenizer, max_length=args.max_length)
+    packed = PackedSFT(ds, max_length=args.max_length)
+    modes = [
+        ("random", ds.lengths(), np.random.default_rng(0).permutation(len(ds))),
+        ("bucketed", ds.lengths(), LengthBucketSampler(ds.lengths(), args.batch_size)),
+        ("packed", packed.lengths(), np.random.default_rng(0).permutation(len(packed))),
+    ]
+    for name, lengths, order in modes:
+        batches = _batches(order, args.batch_size)
+        real, padded = epoch_token_counts(lengths, batches)
+        print(f"{name:>8}: {len(batches)} batches, {padded} tokens per epoch, "
+              f"{real / padded:.1%} real ({padded - real} pad)")
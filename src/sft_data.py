@@ -0,0 +1,129 @@
+# sft_data.py
+"""Pre-tokenized, cached SFT datasets for notebooks/sft.ipynb.
+
+Each example's text is prompt + "\n" + response + EOS, with labels equal to the
+input ids except that prompt tokens are set to -100 so only the response
+contributes to the loss. Every example is tokenized exactly once: the prompt
+length comes from the token offsets instead of tokenizing the prompt again.
+
+The tokenized dataset is saved as flat arrays (all input_ids / labels back to
+back, plus an offsets index) under cache/sft/<key>/ and memory-mapped on load.
+The key hashes the data file's contents, the format template, the tokenizer
+and max_length, so a new format or tokenizer gets its own entry and repeat
+runs skip tokenization entirely.
+"""
+
+
+import os, json, shutil, hashlib
+import numpy as np
+import torch
+from format_data import format_record
+
+
+CACHE_DIR = 'cache/sft/'
+IGNORE_INDEX = -100 # CrossEntropyLoss's default ignore_index
+ARRAY_NAMES = ['input_ids', 'labels', 'offsets']
+
+
+def _tokenizer_key(tok):
+    """Hash of everything about the tokenizer that changes its output."""
+    h = hashlib.sha256()
+    for token, token_id in sorted(tok.get_vocab().items(), key=lambda kv: kv[1]):
+        h.update(f"{token_id}\x00{token}\x01".encode('utf-8'))
+    h.update(f"{type(tok).__name__}|{tok.eos_token}".encode('utf-8'))
+    return h.hexdigest()
+
+
+def cache_key(filename, tok, template=None, max_length=256):
+    """Hash of the data file contents, format template, tokenizer and max_length."""
+    h = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    h.update(f"|template={template}|max_length={max_length}|tok=".encode('utf-8'))
+    h.update(_tokenizer_key(tok).encode('utf-8'))
+    return h.hexdigest()[:20]
+
+
+def _read_examples(filename, template=None):
+    """Yields (prompt, response) pairs, formatting raw records with template if given."""
+    with open(filename, 'r', encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue # ignores whitespace lines
+            data = json.loads(line)
+            if template is not None:
+                data = format_record(data, template)
+            yield data['prompt'], data['response']
+
+
+def tokenize_examples(examples, tok, max_length=256):
+    """Tokenizes (prompt, response) pairs once each and masks the prompt tokens.
+    Returns flat int32 input_ids and labels arrays plus an int64 offsets index
+    (example i is [offsets[i], offsets[i + 1]))."""
+    input_ids = []
+    labels = []
+    offsets = [0]
+    for prompt, response in examples:
+        prompt = prompt.strip()
+        response = response.strip()
+        # full sequence the model will read
+        full_text = prompt + "\n" + response + tok.eos_token
+        # the prompt prefix includes the newline so the first response token isn't masked
+        prompt_chars = len(prompt + "\n")
+
+        enc = tok(full_text, truncation=True, max_length=max_length, return_offsets_mapping=True)
+        ids = enc["input_ids"]
+        prompt_len = sum(1 for start, _ in enc["offset_mapping"] if start < prompt_chars)
+
+        input_ids.extend(ids)
+        labels.extend([IGNORE_INDEX] * min(prompt_len, len(ids)) + ids[prompt_len:])
+        offsets.append(len(input_ids))
+    return (np.asarray(input_ids, dtype=np.int32), np.asarray(labels, dtype=np.int32),
+            np.asarray(offsets, dtype=np.int64))
+
+
+class SFTArrays(torch.utils.data.Dataset):
+    """Dataset over flat (possibly memory-mapped) input_ids / labels arrays.
+    Items are dicts of input_ids and labels arrays; sft_collate.SFTCollator
+    pads them into batches."""
+
+    def __init__(self, input_ids, labels, offsets):
+        self.input_ids = input_ids
+        self.labels = labels
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def lengths(self):
+        return np.diff(self.offsets)
+
+    def __getitem__(self, i):
+        start, end = int(self.offsets[i]), int(self.offsets[i + 1])
+        return {
+            "input_ids": self.input_ids[start:end],
+            "labels": self.labels[start:end],
+        }
+
+
+def load_sft_dataset(filename, tok, template=None, max_length=256, cache_dir=CACHE_DIR):
+    """Returns an SFTArrays dataset for a JSONL file of formatted examples (with
+    'prompt'/'response'), or of raw haikus formatted with the named template.
+    Loads memory-mapped arrays from the cache when possible; otherwise tokenizes
+    and saves them there first."""
+    entry = os.path.join(cache_dir, cache_key(filename, tok, template, max_length))
+    paths = {name: os.path.join(entry, name + ".npy") for name in ARRAY_NAMES}
+    if not all(os.path.exists(p) for p in paths.values()):
+        arrays = tokenize_examples(_read_examples(filename, template), tok, max_length)
+        tmp_entry = entry + ".tmp"
+        os.makedirs(tmp_entry, exist_ok=True)
+        for name, array in zip(ARRAY_NAMES, arrays):
+            np.save(os.path.join(tmp_entry, name + ".npy"), array)
+        with open(os.path.join(tmp_entry, "meta.json"), 'w', encoding='utf-8') as f:
+            json.dump({"source": filename, "template": template, "max_length": max_length,
+                       "examples": len(arrays[2]) - 1, "tokens": len(arrays[0])}, f, indent=1)
+        if os.path.exists(entry): # a partial entry from an interrupted run
+            shutil.rmtree(entry)
+        os.replace(tmp_entry, entry)
+    return SFTArrays(*(np.load(paths[name], mmap_mode='r') for name in ARRAY_NAMES))
@@ -0,0 +1,184 @@
+# sharded_eval.py
+"""Sharded evaluation across worker processes, with checkpoint/resume.
+
+The (model, prompt_fn, keyword, sample_idx) grid of one or more evaluation runs
+is cut into shards, one per generate_batch call of evaluate_suite (see
+generation._suite_batches), so the shards only depend on batch_size. A process
+pool of workers, each with its own model copy and a pinned torch thread count,
+works through the shards model by model. Sample j of keyword kw is seeded with
+sample_seed(seed, prompt_fn.__name__, kw, j) exactly as in evaluate_suite, so the
+merged DataFrame for a run is the same as evaluate_suite's with the same
+batch_size and thread count, whatever the number of workers. (Keep
+threads_per_worker fixed when comparing runs: CPU kernels may sum in a
+different order with another thread count.)
+
+Every finished shard is written to checkpoint_dir/<run key>/ right away, so
+an interrupted evaluation resumes where it stopped when it is called again
+with the same arguments. The run key hashes the model directory's files, so a
+retrained checkpoint at the same path starts a fresh run. Run from root:
+    python src/sharded_eval.py distilgpt2 models/haiku_bot --prompts zero_shot few_shot --workers 8
+    python src/sharded_eval.py models/haiku_bot --workers 4 --threads 2 --save-runs
+"""
+
+
+import os, json, time, hashlib, argparse
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing as mp
+from eval_scoring import make_zero_shot_prompt, make_few_shot_prompt, score_completions, result_row, RESULT_COLUMNS
+from test_data_keywords import particle_physics_keywords
+
+
+PROMPT_FNS = {"zero_shot": make_zero_shot_prompt, "few_shot": make_few_shot_prompt}
+CHECKPOINT_DIR = 'cache/eval_shards/'
+
+
+def _run_key(model_name_or_path, fingerprint, precision, prompt_fn, keywords, n_per_keyword, batch_size, seed, threads,
+             gen_kwargs):
+    """Checkpoint directory name for one run: a hash of everything its samples depend on,
+    including the model's contents (generation.model_fingerprint)."""
+    config = json.dumps([model_name_or_path, fingerprint, precision, prompt_fn.__name__, list(keywords), n_per_keyword,
+                         batch_size, seed, threads, gen_kwargs], sort_keys=True, default=repr)
+    return hashlib.sha256(config.encode('utf-8')).hexdigest()[:16]
+
+
+def _shard_path(run_dir, shard_idx):
+    return os.path.join(run_dir, f"shard_{shard_idx:05d}.json")
+
+
+# --- worker process ---
+_worker_model = None # (model_name_or_path, precision, model, tok) of the last shard
+
+
+def _init_worker(threads):
+    import torch
+
+    torch.set_num_threads(threads)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError: # only allowed before any parallel work
+        pass
+
+
+def _run_shard(model_name_or_path, precision, prompt_fn, batch_keywords, sample_idxs, seed, gen_kwargs, path):
+    """Generates and scores one shard and writes its rows and token counts to path."""
+    global _worker_model
+    from generation import PREFIX_CACHE, load_model_and_tokenizer, generate_batch, sample_seed
+
+    if _worker_model is None or _worker_model[:2] != (model_name_or_path, precision):
+        _worker_model = None # free the previous model first
+        _worker_model = (model_name_or_path, precision, *load_model_and_tokenizer(model_name_or_path, precision))
+    _, _, model, tok = _worker_model
+
+    prompts = [prompt_fn(kw) for kw in batch_keywords]
+    seeds = [sample_seed(seed, prompt_fn.__name__, kw, j) for kw in batch_keywords for j in sample_idxs]
+    stats = {'generated_tokens': 0, 'saved_tokens': 0}
+    completions = generate_batch(model, tok, prompts, seeds, num_return_sequences=len(sample_idxs), stats=stats,
+                                 prefix=PREFIX_CACHE.get(model, tok, prompt_fn), **gen_kwargs)
+    results = score_completions([p for p in prompts for _ in sample_idxs], completions)
+    rows = [result_row(r, c) for r, c in zip(results, completions)]
+    with open(path + ".tmp", 'w', encoding='utf-8') as f:
+        json.dump({"rows": rows, "stats": stats}, f)
+    os.replace(path + ".tmp", path)
+    return path
+
+
+# --- coordinator ---
+def evaluate_sharded(runs, keywords=particle_physics_keywords, n_per_keyword=8, batch_size=32, seed=0,
+                     workers=None, threads_per_worker=1, precision=None, checkpoint_dir=CHECKPOINT_DIR, progress=None,
+                     **gen_kwargs):
+    """Evaluates every (model_name_or_path, prompt_fn) pair in runs over keywords on a
+    pool of workers processes (default: cpu_count // threads_per_worker). Returns one
+    results DataFrame per run, each with the rows and df.attrs of evaluate_suite.
+    Models are loaded in precision (see generation.PRECISIONS). Shards already in
+    checkpoint_dir are reused; progress, if given, is called with (shards done,
+    total shards) after each shard."""
+    import pandas as pd
+    from generation import _suite_batches, model_fingerprint
+
+    workers = workers or max(1, (os.cpu_count() or 1) // threads_per_worker)
+    gen_kwargs = dict(gen_kwargs)
+    run_shards = []
+    tasks = [] # run-major, so each worker mostly keeps one model loaded
+    for model_name_or_path, prompt_fn in runs:
+        fingerprint = model_fingerprint(model_name_or_path)
+        key = _run_key(model_name_or_path, fingerprint, precision, prompt_fn, keywords, n_per_keyword, batch_size, seed,
+                       threads_per_worker, gen_kwargs)
+        run_dir = os.path.join(checkpoint_dir, key)
+        os.makedirs(run_dir, exist_ok=True)
+        with open(os.path.join(run_dir, "run.json"), 'w', encoding='utf-8') as f:
+            json.dump({"model": model_name_or_path, "fingerprint": fingerprint, "precision": precision,
+                       "prompt_fn": prompt_fn.__name__, "keywords": list(keywords), "n_per_keyword": n_per_keyword, "batch_size": batch_size, "seed": seed,
+                       "threads_per_worker": threads_per_worker, "gen_kwargs": gen_kwargs}, f, indent=1, default=repr)
+        shard_paths = []
+        for shard_idx, (batch_keywords, sample_idxs) in enumerate(_suite_batches(list(keywords), n_per_keyword, batch_size)):
+            path = _shard_path(run_dir, shard_idx)
+            shard_paths.append(path)
+            if not os.path.exists(path):
+                tasks.append((model_name_or_path, precision, prompt_fn, batch_keywords, list(sample_idxs), seed, gen_kwargs, path))
+        run_shards.append(shard_paths)
+
+    total = sum(len(paths) for paths in run_shards)
+    done = total - len(tasks)
+    if tasks:
+        # spawn: forked children would inherit the parent's torch thread pools
+        with ProcessPoolExecutor(max_workers=min(workers, len(tasks)), mp_context=mp.get_context("spawn"),
+                                 initializer=_init_worker, initargs=(threads_per_worker,)) as pool:
+            futures = [pool.submit(_run_shard, *task) for task in tasks]
+            try:
+                for future in futures:
+                    future.result()
+                    done += 1
+                    if progress is not None:
+                        progress(done, total)
+            except BaseException:
+                # finished shards are already on disk for the next call
+                pool.shutdown(wait=False, cancel_futures=True)
+                raise
+
+    dfs = []
+    for (model_name_or_path, prompt_fn), shard_paths in zip(runs, run_shards):
+        rows = []
+        stats = {'generated_tokens': 0, 'saved_tokens': 0}
+        for path in shard_paths:
+            with open(path, 'r', encoding='utf-8') as f:
+                shard = json.load(f)
+            rows += shard["rows"]
+            for k in stats:
+                stats[k] += shard["stats"][k]
+        df = pd.DataFrame(rows, columns=RESULT_COLUMNS)
+        df.attrs.update(stats)
+        df.attrs.update(model=model_name_or_path, precision=precision, prompt_fn=prompt_fn.__name__, seed=seed,
+                        n_per_keyword=n_per_keyword, gen_kwargs=gen_kwargs)
+        dfs.append(df)
+    return dfs
+
+
+if __name__ == "__main__":
+    from generation import GEN_KW, PRECISIONS
+
+    parser = argparse.ArgumentParser(description="Evaluate models on the test keywords across worker processes.")
+    parser.add_argument("models", nargs="+", help="model names or checkpoint directories")
+    parser.add_argument("--prompts", nargs="+", choices=list(PROMPT_FNS), default=["zero_shot"])
+    parser.add_argument("--n-per-keyword", type=int, default=8)
+    parser.add_argument("--batch-size", type=int, default=32, help="samples per shard")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=None, help="default: cpu_count // threads")
+    parser.add_argument("--threads", type=int, default=1, help="torch threads per worker (default: 1)")
+    parser.add_argument("--precision", choices=list(PRECISIONS), default=None, help="see generation.PRECISIONS")
+    parser.add_argument("--checkpoint-dir", default=CHECKPOINT_DIR)
+    parser.add_argument("--save-runs", action="store_true", help="save each run to the results store")
+    args = parser.parse_args()
+
+    runs = [(model, PROMPT_FNS[p]) for model in args.models for p in args.prompts]
+    start = time.perf_counter()
+    dfs = evaluate_sharded(runs, n_per_keyword=args.n_per_keyword, batch_size=args.batch_size, seed=args.seed,
+                           workers=args.workers, threads_per_worker=args.threads,
+                           precision=args.precision, checkpoint_dir=args.checkpoint_dir,
+                           progress=lambda done, total: print(f"\r{done}/{total} shards", end="", flush=True),
+                           **GEN_KW)
+    print(f"\nEvaluated {len(runs)} run(s) in {time.perf_counter() - start:.1f}s")
+    for (model, prompt_fn), df in zip(runs, dfs):
+        print(f"{model} ({prompt_fn.__name__}): {len(df)} haikus, haiku pass rate {df['haiku_ok'].mean():.2f}")
+        if args.save_runs:
+            from results_store import save_run
+            print(f"  saved as {save_run(df, f'{model} ({prompt_fn.__name__})')}")
@@ -0,0 +1,163 @@
+# syllable_constraint.py
+"""Syllable-budget constrained decoding for haiku generation.
+
+SyllableBudgetProcessor is a transformers LogitsProcessor that tracks how many
+syllables the current haiku line of every batch row has so far, using the same
+counting rules as haiku_check_helpers._count_syllables, and on each step
+- masks tokens whose syllables would overshoot the line's 5/7/5 budget,
+- masks newlines (and EOS) while the line is still short of its budget, unless
+  it is still empty or just a number placeholder like "3)",
+- forces a newline once the budget is met.
+After the third line the completion is left alone so the model can write <END>.
+
+Token syllable counts come from a per-vocabulary table built once per tokenizer
+(cached in-process and in cache/vocab_syllables_<key>.bin, whose header
+records the tokenizer key and vocabulary size; a file that doesn't match is
+rebuilt). A token's count is taken as if it were a whole word, which is exact
+for word-initial tokens and an estimate for sub-word continuations. Token ids
+past the end of the table (a model whose logits are wider than its tokenizer's
+vocabulary) are never allowed on a constrained line.
+"""
+
+
+import os, struct, hashlib
+import torch
+from transformers import LogitsProcessor
+from haiku_check_helpers import EXPECTED_SYLLABLES, _count_syllables
+from syllable_lexicon import LEXICON_VERSION
+from eval_scoring import _strip_line_number_prefix
+
+
+CACHE_DIR = 'cache/'
+_vocab_tables = {} # tokenizer key -> (syllables, has_newline) tensors
+
+_MAGIC = b"HKVOC"
+_HEADER = struct.Struct("<5s16sI") # magic, tokenizer key, vocabulary size
+
+
+def _tokenizer_key(tok):
+    """Hash of the tokenizer's vocabulary and the lexicon version."""
+    h = hashlib.sha256(f"lexicon={LEXICON_VERSION}".encode('utf-8'))
+    for token, token_id in sorted(tok.get_vocab().items(), key=lambda kv: kv[1]):
+        h.update(f"{token_id}\x00{token}\x01".encode('utf-8'))
+    return h.hexdigest()[:16]
+
+
+def _vocab_size(tok):
+    """Number of token ids the table covers (added tokens can extend past len(vocab))."""
+    return max(len(tok), max(tok.get_vocab().values()) + 1)
+
+
+def _build_vocab_table(tok):
+    """Returns (syllables, has_newline) byte lists indexed by token id."""
+    vocab_size = _vocab_size(tok)
+    syllables = bytearray(vocab_size)
+    has_newline = bytearray(vocab_size)
+    for token_id in range(vocab_size):
+        text = tok.decode([token_id], skip_special_tokens=True)
+        syllables[token_id] = min(255, sum(_count_syllables(w) for w in text.split()))
+        has_newline[token_id] = "\n" in text
+    return syllables, has_newline
+
+
+def _save_vocab_table(path, key, syllables, has_newline):
+    """Writes a header, one syllable byte per token, then one newline flag byte per token."""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(_HEADER.pack(_MAGIC, key.encode('ascii'), len(syllables)))
+        f.write(bytes(syllables) + bytes(has_newline))
+    os.replace(tmp_path, path) # never leave a half-written table behind
+
+
+def _load_vocab_table(path, key, vocab_size):
+    """Reads a table written by _save_vocab_table. Returns None if the file is
+    missing, corrupt, or was built for another tokenizer or vocabulary size."""
+    try:
+        with open(path, 'rb') as f:
+            blob = f.read()
+    except OSError:
+        return None
+    if len(blob) < _HEADER.size:
+        return None
+    magic, file_key, n = _HEADER.unpack_from(blob)
+    if magic != _MAGIC or file_key != key.encode('ascii') or n != vocab_size:
+        return None
+    start = _HEADER.size
+    if len(blob) != start + 2 * n:
+        return None
+    return blob[start:start + n], blob[start + n:]
+
+
+def vocab_syllable_table(tok):
+    """Per-token syllable counts and newline flags for tok's vocabulary as
+    (syllables, has_newline) tensors. Built once per tokenizer and cached."""
+    key = _tokenizer_key(tok)
+    if key not in _vocab_tables:
+        path = f"{CACHE_DIR}vocab_syllables_{key}.bin"
+        table = _load_vocab_table(path, key, _vocab_size(tok))
+        if table is None:
+            table = _build_vocab_table(tok)
+            try:
+                os.makedirs(CACHE_DIR, exist_ok=True)
+                _save_vocab_table(path, key, *table)
+            except OSError:
+                pass # read-only checkout; just keep the in-memory table
+        syllables, has_newline = table
+        _vocab_tables[key] = (torch.tensor(list(syllables), dtype=torch.long),
+                              torch.tensor(list(has_newline), dtype=torch.bool))
+    return _vocab_tables[key]
+
+
+def line_state(completion):
+    """Returns (line_index, syllables_so_far) for the haiku line being written at
+    the end of completion. Earlier lines that are empty or just a number
+    placeholder like "2)" don't count as haiku lines."""
+    *done, current = completion.split("\n")
+    line_index = sum(1 for line in done if _strip_line_number_prefix(line))
+    syllables = sum(_count_syllables(w) for w in _strip_line_number_prefix(current).split())
+    return line_index, syllables
+
+
+class SyllableBudgetProcessor(LogitsProcessor):
+    """Masks tokens so each of the first 3 lines of every row's completion lands on
+    its 5/7/5 syllable budget. The prompt length is taken from the first call, so
+    use a new processor for every generate() call."""
+
+    def __init__(self, tok):
+        self.tok = tok
+        self.syllables, self.has_newline = vocab_syllable_table(tok)
+        self.eos_token_id = tok.eos_token_id
+        self.prompt_len = None
+
+    def __call__(self, input_ids, scores):
+        if self.prompt_len is None:
+            self.prompt_len = input_ids.shape[1]
+        vocab = scores.shape[1]
+        if vocab > len(self.syllables):
+            # ids past the tokenizer's vocabulary: too many syllables for any line and
+            # no newline, so they are masked whatever the line's budget
+            extra = vocab - len(self.syllables)
+            self.syllables = torch.cat([self.syllables, torch.full((extra,), 255, dtype=torch.long)])
+            self.has_newline = torch.cat([self.has_newline, torch.zeros(extra, dtype=torch.bool)])
+        syllables = self.syllables[:vocab].to(scores.device)
+        has_newline = self.has_newline[:vocab].to(scores.device)
+
+        texts = self.tok.batch_decode(input_ids[:, self.prompt_len:], skip_special_tokens=True)
+        for row, text in enumerate(texts):
+            line_index, so_far = line_state(text)
+            if line_index >= len(EXPECTED_SYLLABLES):
+                continue # haiku done; let the model close it out
+            remaining = EXPECTED_SYLLABLES[line_index] - so_far
+            if remaining <= 0:
+                # budget met (or overshot by an approximate count): only a line break may follow
+                mask = ~has_newline
+            elif not _strip_line_number_prefix(text.split("\n")[-1]):
+                # the line is empty or just a placeholder like "3)", which line_state doesn't
+                # count as a haiku line, so a bare line break (no syllables) may still follow
+                mask = (has_newline & (syllables > 0)) | (syllables > remaining)
+            else:
+                mask = has_newline | (syllables > remaining)
+                if self.eos_token_id is not None and self.eos_token_id < vocab:
+                    mask[self.eos_token_id] = True
+            scores[row] = scores[row].masked_fill(mask, float("-inf"))
+        return scores
@@ -0,0 +1,209 @@
+# syllable_lexicon.py
+"""Precompiled word -> syllable count lexicon used by haiku_check_helpers.
+
+The lexicon is built once from CMUdict (first pronunciation of every word) plus
+the syllables estimator for any corpus words CMUdict doesn't know, and saved to
+cache/syllable_lexicon.bin under the repo root (found from this file, so importing
+from notebooks/ or src/ doesn't leave a stray cache/ there). Loading that file is
+a single read and split, so neither CMUdict nor the estimator has to be touched
+on a normal run. Words that are in neither get estimated on the fly and kept in
+a bounded LRU cache.
+
+Every lookup also reports whether its count came from the estimator rather than
+CMUdict, since those counts are the ones most likely to be wrong.
+
+Run from root to (re)build the lexicon and list estimator-derived corpus words:
+    python src/syllable_lexicon.py
+"""
+
+
+import os, re, json, glob, struct
+from functools import lru_cache
+
+
+LEXICON_VERSION = 1 # bump whenever the counting rules or the file layout change
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_LEXICON_PATH = os.path.join(REPO_ROOT, 'cache', 'syllable_lexicon.bin')
+ESTIMATE_CACHE_SIZE = 4096 # unknown word parts kept in-process
+WORD_CACHE_SIZE = 65536 # raw (unsplit, uncleaned) words kept in-process
+
+_MAGIC = b"HKSYL"
+_HEADER = struct.Struct("<5sBI") # magic, version, number of entries
+_ESTIMATED_FLAG = 0x80 # high bit of a count byte marks an estimator-derived count
+
+_table = None # word part -> count byte (with _ESTIMATED_FLAG), loaded lazily
+_estimated_seen = set() # estimator-derived parts looked up in this process
+
+
+def _clean_part(part):
+    """Lowercases and strips everything but letters and apostrophes."""
+    return re.sub(r"[^a-zA-Z']", "", part.lower())
+
+
+def _split_word(word):
+    """Splits on hyphen/dash variants (so non-inertial -> ["non", "inertial"])
+    and cleans each part, dropping any that end up empty."""
+    parts = (_clean_part(p) for p in re.split(r"[-–—−]+", word))
+    return [p for p in parts if p]
+
+
+def _estimate(part):
+    # imported here so the estimator is only loaded when a word is actually unknown
+    import syllables
+    return syllables.estimate(part)
+
+
+@lru_cache(maxsize=ESTIMATE_CACHE_SIZE)
+def _estimate_cached(part):
+    return _estimate(part)
+
+
+def build_lexicon(extra_words=()):
+    """Builds the word -> count byte table from CMUdict, using the first
+    pronunciation of each word just like pronouncing.phones_for_word()[0].
+    Any cleaned part of extra_words missing from CMUdict is added with its
+    syllables.estimate() count and flagged as estimated."""
+    import pronouncing
+    pronouncing.init_cmu()
+
+    table = {}
+    for word, phones in pronouncing.lookup.items():
+        table[word] = pronouncing.syllable_count(phones[0])
+
+    for word in extra_words:
+        for part in _split_word(word):
+            if part not in table:
+                table[part] = _estimate(part) | _ESTIMATED_FLAG
+    return table
+
+
+def save_lexicon(table, path=DEFAULT_LEXICON_PATH):
+    """Writes table as a header, one count byte per word, then the
+    newline-joined words in sorted order (same order as the count bytes)."""
+    words = sorted(table)
+    dirname = os.path.dirname(path)
+    if dirname:
+        os.makedirs(dirname, exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(_HEADER.pack(_MAGIC, LEXICON_VERSION, len(words)))
+        f.write(bytes(table[w] for w in words))
+        f.write("\n".join(words).encode('utf-8'))
+    os.replace(tmp_path, path) # never leave a half-written lexicon behind
+
+
+def load_lexicon(path=DEFAULT_LEXICON_PATH):
+    """Reads a lexicon written by save_lexicon. Returns None if the file is
+    missing, corrupt, or was written by a different LEXICON_VERSION."""
+    try:
+        with open(path, 'rb') as f:
+            blob = f.read()
+    except OSError:
+        return None
+    if len(blob) < _HEADER.size:
+        return None
+    magic, version, n = _HEADER.unpack_from(blob)
+    if magic != _MAGIC or version != LEXICON_VERSION:
+        return None
+    start = _HEADER.size
+    counts = blob[start:start + n]
+    words = blob[start + n:].decode('utf-8').split("\n") if n else []
+    if len(counts) != n or len(words) != n:
+        return None
+    return dict(zip(words, counts))
+
+
+def get_table(path=DEFAULT_LEXICON_PATH):
+    """Returns the in-process table, loading it from path on first use and
+    building (and trying to save) it from CMUdict if the file isn't usable."""
+    global _table
+    if _table is None:
+        table = load_lexicon(path)
+        if table is None:
+            table = build_lexicon()
+            try:
+                save_lexicon(table, path)
+            except OSError:
+                pass # read-only checkout; just keep the in-memory table
+        _table = table
+    return _table
+
+
+def lookup_part(part):
+    """Returns (num_syllables, estimated) for an already-cleaned word part."""
+    entry = get_table().get(part)
+    if entry is None:
+        _estimated_seen.add(part)
+        return _estimate_cached(part), True
+    if entry & _ESTIMATED_FLAG:
+        _estimated_seen.add(part)
+        return entry & ~_ESTIMATED_FLAG, True
+    return entry, False
+
+
+@lru_cache(maxsize=WORD_CACHE_SIZE)
+def count_word(word):
+    """Counts syllables in a raw word (punctuation, hyphens and all).
+    Returns (num_syllables, estimated) where estimated is True if any part of
+    the word had to fall back on the syllables estimator."""
+    total = 0
+    estimated = False
+    for part in _split_word(word):
+        n, est = lookup_part(part)
+        total += n
+        estimated = estimated or est
+    return total, estimated
+
+
+def estimated_words():
+    """Sorted list of word parts looked up so far in this process whose
+    syllable counts came from the estimator instead of CMUdict."""
+    return sorted(_estimated_seen)
+
+
+def _corpus_words():
+    """All whitespace-separated words in the raw haikus and keywords."""
+    from train_data_keywords import train_keyword_families
+    from eval_data_keywords import cosmology_keywords
+    from test_data_keywords import particle_physics_keywords
+
+    words = set()
+    for family_keywords in train_keyword_families + [cosmology_keywords, particle_physics_keywords]:
+        for keyword in family_keywords:
+            words.update(keyword.split())
+    for filename in sorted(glob.glob('data/*/*.jsonl')):
+        with open(filename, 'r', encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    words.update(json.loads(line)['haiku'].split())
+    return words
+
+
+def clear_caches():
+    """Drops the in-process table and LRU caches, so the next lookup loads the
+    lexicon from disk again (a truly cold start, e.g. for benchmarks)."""
+    global _table
+    _table = None
+    count_word.cache_clear()
+    _estimate_cached.cache_clear()
+
+
+def rebuild_lexicon(path=DEFAULT_LEXICON_PATH):
+    """Builds the lexicon from CMUdict plus the corpus vocabulary, saves it to
+    path, and makes it the in-process table. Returns the table."""
+    global _table
+    table = build_lexicon(_corpus_words())
+    save_lexicon(table, path)
+    _table = table
+    count_word.cache_clear()
+    _estimate_cached.cache_clear()
+    return table
+
+
+if __name__ == "__main__":
+    table = rebuild_lexicon()
+    estimated = sorted(w for w, c in table.items() if c & _ESTIMATED_FLAG)
+    print(f"Saved {len(table)} words to {DEFAULT_LEXICON_PATH}.")
+    print(f"{len(estimated)} corpus words not in CMUdict use estimated syllable counts:")
+    for word in estimated:
+        print(f"  {word}: {table[word] & ~_ESTIMATED_FLAG}")